@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+    Offline benchmark of the plugin actions.
+
+    Every action of Main runs in a fresh interpreter against the stub
+    xbmc* modules (benchmarks/stubs) with IMDb answered from the recorded
+    fixtures (benchmarks/fixtures), and the script reports per action:
+
+        wall   time from importing the add-on to the end of the action
+        parse  time spent in HTML parsing, JSON decoding and record extraction
+        alloc  peak memory allocated by python during the action (tracemalloc)
+        http   requests that reached the network (fixtures) and their bytes
+        items  directory items added, or the resolved playback URL
+
+    Cold runs start from an empty profile, warm runs repeat the action in
+    the profile left behind by a first run. Expired runs do the same after
+    expiring every cached response and listing, which measures revalidation.
+    Stale runs leave the responses within their stale time, so they are
+    served at once and revalidated in the background.
+    With --worker the actions are handed to a resident worker running in
+    another process, as the service does in Kodi; its requests are not
+    counted under http, and --warm then measures a listing it already served.
+
+        python benchmarks/actions.py [--runs N] [--warm | --expired | --stale] [--worker] [--action NAME ...]
+        python benchmarks/actions.py --check-parsers
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+PLUGIN = 'plugin://plugin.video.imdb.trailers/'
+
+ACTIONS = [('main_menu', ''),
+           ('showing', '?action=list2&key=showing'),
+           ('coming', '?action=list2&key=coming'),
+           ('trending', '?action=list3&key=trending'),
+           ('anticipated', '?action=list3&key=anticipated'),
+           ('popular', '?action=list3&key=popular'),
+           ('recent', '?action=list3&key=recent'),
+           ('next_page', '?action=list3&key=trending&token=tok-TrendingTitles-1&page=1'),
+           ('search', '?action=search'),
+           ('play', '?action=play&videoid=vi1357573626'),
+           ('play_id', '?action=play_id&imdb=tt0000001')]
+
+
+def setup_path():
+    sys.path[:0] = [os.path.join(HERE, 'stubs'), ROOT, HERE]
+
+
+class Timer(object):
+    def __init__(self):
+        self.total = 0.0
+
+    def wrap(self, func):
+        def timed(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.total += time.time() - start
+        return timed
+
+
+def child(query):
+    import tracemalloc
+    setup_path()
+    sys.argv = [PLUGIN, '1', query]
+
+    start = time.time()
+    from resources.lib import imdb_trailers, parsers
+    import replay
+    import requests
+    import xbmcgui
+    import xbmcplugin
+
+    adapter = replay.ReplayAdapter()
+    session = imdb_trailers.get_session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    parse = Timer()
+    parsers.parse_titles = parse.wrap(parsers.parse_titles)
+    parsers.parse_search = parse.wrap(parsers.parse_search)
+    parsers.parse_graphql = parse.wrap(parsers.parse_graphql)
+    requests.models.Response.json = parse.wrap(requests.models.Response.json)
+
+    tracemalloc.start()
+    imdb_trailers.Main()
+    wall = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # background refreshes of stale responses count under http
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and not thread.daemon:
+            thread.join()
+
+    resolved = [listitem.path for listitem in xbmcplugin.resolved]
+    print(json.dumps({'wall': wall,
+                      'parse': parse.total,
+                      'peak': peak,
+                      'calls': len(adapter.calls),
+                      'bytes': adapter.bytes,
+                      'items': len(xbmcplugin.items),
+                      'resolved': resolved[0] if resolved else None,
+                      'notifications': [message for _, message in xbmcgui.notifications]}))
+
+
+def serve():
+    """
+    Run the resident worker against the fixtures until stdin is closed.
+    """
+    setup_path()
+    from resources.lib import imdb_trailers, worker
+    import replay
+
+    adapter = replay.ReplayAdapter()
+    imdb_trailers.get_session().mount('https://', adapter)
+    resident = worker.Worker()
+    resident.start()
+    sys.stdin.read()
+    resident.stop()
+
+
+def start_worker(home):
+    env = dict(os.environ, KODI_STUB_HOME=home)
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve'], env=env,
+                               stdin=subprocess.PIPE)
+    window = os.path.join(home, 'window-10000.json')
+    while not os.path.exists(window):
+        time.sleep(0.01)
+    return process
+
+
+def run(query, home):
+    env = dict(os.environ, KODI_STUB_HOME=home, KODI_STUB_KEYBOARD='matrix')
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', query], env=env)
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+def expire(home, stale=False):
+    profile = os.path.join(home, 'userdata', 'addon_data', 'plugin.video.imdb.trailers')
+    past = time.time() - 1
+    responses = 'UPDATE responses SET expires = ?' if stale else 'UPDATE responses SET expires = ?, keep_until = ?'
+    for name, statement in (('http_cache.db', responses),
+                            ('records_cache.db', 'UPDATE listings SET expires = ?'),
+                            ('records_cache.db', 'UPDATE streams SET expires = ?')):
+        path = os.path.join(profile, name)
+        if os.path.exists(path):
+            conn = sqlite3.connect(path)
+            try:
+                with conn:
+                    conn.execute(statement, (past,) * statement.count('?'))
+            except sqlite3.OperationalError:
+                # table not created by this action
+                pass
+            conn.close()
+
+
+def measure(query, warm, expired=False, worker=False, stale=False):
+    home = tempfile.mkdtemp(prefix='kodi-stub-')
+    process = start_worker(home) if worker else None
+    try:
+        if warm or expired or stale:
+            run(query, home)
+        if expired or stale:
+            expire(home, stale)
+        return run(query, home)
+    finally:
+        if process is not None:
+            process.stdin.close()
+            process.wait()
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def check_parsers():
+    """
+    Compare the records every available parser backend extracts from the fixtures.
+    """
+    setup_path()
+    from resources.lib import parsers
+    import replay
+
+    backends = []
+    for backend in parsers.BACKENDS:
+        try:
+            backends.append(backend())
+        except ImportError:
+            print('{}: not available'.format(backend.name))
+
+    pages = [('movies-in-theaters.html', 'titles', parsers.MAIN_BLOCK),
+             ('find.html', 'search', None)]
+    pages += [('movies-coming-soon-{}.html'.format(i), 'titles', parsers.LIST_BLOCK) for i in range(4)]
+    failed = False
+    for name, method, block in pages:
+        with open(os.path.join(replay.FIXTURES, name)) as f:
+            page_data = f.read()
+        results = []
+        for backend in backends:
+            args = (page_data, block) if block else (page_data,)
+            start = time.time()
+            records = getattr(backend, method)(*args)
+            results.append((backend.name, records, time.time() - start))
+        same = all(records == results[0][1] for _, records, _ in results)
+        failed = failed or not same
+        print('{:<28} {:>4} records  {}  {}'.format(name, len(results[0][1]), 'identical' if same else 'DIFFERENT',
+                                                     '  '.join('{} {:.1f}ms'.format(n, t * 1000) for n, _, t in results)))
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--warm', action='store_true', help='measure a second run in the same profile')
+    parser.add_argument('--expired', action='store_true', help='measure a second run after expiring the caches')
+    parser.add_argument('--stale', action='store_true', help='as --expired, with the responses still servable stale')
+    parser.add_argument('--worker', action='store_true', help='hand the actions to a resident worker')
+    parser.add_argument('--action', action='append', help='only run the named action(s)')
+    parser.add_argument('--check-parsers', action='store_true', help='compare the parser backends on the fixtures')
+    parser.add_argument('--child')
+    parser.add_argument('--serve', action='store_true')
+    args = parser.parse_args()
+
+    if args.child is not None:
+        return child(args.child)
+    if args.serve:
+        return serve()
+    if args.check_parsers:
+        return check_parsers()
+
+    print('{:<12} {:>9} {:>9} {:>9} {:>5} {:>9} {:>6}'.format('action', 'wall ms', 'parse ms', 'peak KiB',
+                                                               'http', 'KiB in', 'items'))
+    for name, query in ACTIONS:
+        if args.action and name not in args.action:
+            continue
+        results = [measure(query, args.warm, args.expired, args.worker, args.stale) for _ in range(args.runs)]
+        last = results[-1]
+        print('{:<12} {:9.1f} {:9.1f} {:9.0f} {:5d} {:9.1f} {:>6}'.format(
+            name,
+            median([r['wall'] for r in results]) * 1000,
+            median([r['parse'] for r in results]) * 1000,
+            median([r['peak'] for r in results]) / 1024.0,
+            last['calls'],
+            last['bytes'] / 1024.0,
+            'url' if last['resolved'] else last['items']))
+    mode = 'expired' if args.expired else 'stale' if args.stale else 'warm' if args.warm else 'cold'
+    print('median of {} {} runs{}'.format(args.runs, mode,
+                                          ' through the worker' if args.worker else ''))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+    HTTP cache storage benchmark.
+
+    Every recorded response in benchmarks/fixtures is stored in each cache
+    backend, then the script reports the size of the database file and
+    the time to read all of them back (warm reads, body included):
+
+        raw            HttpCache with compression off
+        zlib / zstd    HttpCache with compressed bodies (zstd if installed)
+        requests_cache the requests_cache sqlite backend, if installed
+
+        python benchmarks/http_cache.py [--runs N] [--copies N]
+
+    --copies stores every fixture under that many URLs, to look at a cache
+    closer to its size limit than the handful of fixtures.
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path[:0] = [ROOT]
+
+from resources.lib import cache  # noqa: E402
+
+FIXTURES = os.path.join(HERE, 'fixtures')
+MAX_SIZE = 1024 ** 3
+
+
+def responses(copies):
+    for name in sorted(os.listdir(FIXTURES)):
+        with open(os.path.join(FIXTURES, name), 'rb') as f:
+            body = f.read()
+        for copy in range(copies):
+            yield 'https://fixtures.invalid/{}/{}'.format(copy, name), body
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def bench_http_cache(folder, items, compression, runs):
+    path = os.path.join(folder, 'http_cache.db')
+    store = cache.HttpCache(path, MAX_SIZE, compression)
+    now = time.time()
+    for url, body in items:
+        store.set(url, 200, 'utf-8', {'Content-Type': 'text/html'}, body, now + 3600, now + 7200,
+                  hashlib.sha1(body).hexdigest())
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        for url, body in items:
+            assert len(store.get(url).body) == len(body)
+        times.append(time.time() - start)
+    return os.path.getsize(path), median(times)
+
+
+def bench_requests_cache(folder, items, runs):
+    import requests
+    import requests_cache
+    from requests.adapters import BaseAdapter, HTTPAdapter
+    from urllib3.response import HTTPResponse
+
+    bodies = dict(items)
+
+    class FixtureAdapter(BaseAdapter):
+        def send(self, request, **kwargs):
+            body = bodies[request.url]
+            raw = HTTPResponse(body=io.BytesIO(body), status=200, preload_content=False,
+                               headers={'Content-Type': 'text/html', 'Content-Length': str(len(body))})
+            return HTTPAdapter().build_response(request, raw)
+
+        def close(self):
+            pass
+
+    path = os.path.join(folder, 'requests_cache')
+    session = requests_cache.CachedSession(path, backend='sqlite', expire_after=3600)
+    session.mount('https://', FixtureAdapter())
+    for url, _ in items:
+        session.get(url)
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        for url, body in items:
+            response = session.get(url)
+            assert getattr(response, 'from_cache', False) and len(response.content) == len(body)
+        times.append(time.time() - start)
+    session.close()
+    return os.path.getsize(path + '.sqlite'), median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--copies', type=int, default=1)
+    args = parser.parse_args()
+
+    items = list(responses(args.copies))
+    total = sum(len(body) for _, body in items)
+    print('{} responses, {:.0f} KiB of bodies'.format(len(items), total / 1024.0))
+    print('{:<15} {:>10} {:>14}'.format('backend', 'file KiB', 'warm read ms'))
+
+    backends = [('raw', lambda folder: bench_http_cache(folder, items, False, args.runs))]
+    zstandard = cache.zstandard
+    if zstandard is not None:
+        backends.append(('zstd', lambda folder: bench_http_cache(folder, items, True, args.runs)))
+
+    def zlib_only(folder):
+        cache.zstandard = None
+        try:
+            return bench_http_cache(folder, items, True, args.runs)
+        finally:
+            cache.zstandard = zstandard
+    backends.append(('zlib', zlib_only))
+    backends.append(('requests_cache', lambda folder: bench_requests_cache(folder, items, args.runs)))
+
+    for name, bench in backends:
+        folder = tempfile.mkdtemp(prefix='http-cache-')
+        try:
+            size, read = bench(folder)
+        except ImportError as e:
+            print('{:<15} not available ({})'.format(name, e))
+            continue
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        print('{:<15} {:10.0f} {:14.1f}'.format(name, size / 1024.0, read * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+    Concurrent load against the local IMDb stand-in (benchmarks/server.py).
+
+    Fires many plugin invocations at once, each in a fresh interpreter as
+    Kodi runs them, with the add-on pointed at the stand-in through its
+    hidden imdb_url/graphql_url settings. The invocations share one
+    profile, so they also contend for the cache databases. Reports per
+    action the invocations, failures and p50/p95/p99 latency, and the
+    overall throughput:
+
+        python benchmarks/load.py [--invocations N] [--concurrency N]
+                                  [--action NAME ...] [--fresh-profiles]
+                                  [--latency MS] [--jitter F]
+                                  [--bandwidth KB] [--error-rate F]
+
+    A failure is an invocation that crashed, or that gave up with a
+    notification and nothing listed or resolved.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+PLUGIN = 'plugin://plugin.video.imdb.trailers/'
+
+
+def child(query):
+    sys.path[:0] = [os.path.join(HERE, 'stubs'), ROOT]
+    sys.argv = [PLUGIN, '1', query]
+    start = time.time()
+    from resources.lib import imdb_trailers
+    import xbmcgui
+    import xbmcplugin
+    imdb_trailers.Main()
+    print(json.dumps({'wall': time.time() - start,
+                      'items': len(xbmcplugin.items),
+                      'resolved': len(xbmcplugin.resolved),
+                      'notifications': [message for _, message in xbmcgui.notifications]}))
+
+
+def invoke(query, home, settings):
+    env = dict(os.environ, KODI_STUB_HOME=home, KODI_STUB_KEYBOARD='matrix', KODI_STUB_SETTINGS=settings)
+    start = time.time()
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', query], env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    wall = time.time() - start
+    if process.returncode != 0:
+        return wall, False, err.decode('utf-8', 'replace').strip().splitlines()[-1:]
+    result = json.loads(out.decode('utf-8').strip().splitlines()[-1])
+    ok = result['items'] or result['resolved'] or not result['notifications']
+    return wall, bool(ok), result['notifications']
+
+
+def percentile(values, share):
+    values = sorted(values)
+    # nearest rank
+    return values[max(0, int(math.ceil(share * len(values))) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--invocations', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--action', action='append', help='only invoke the named action(s)')
+    parser.add_argument('--fresh-profiles', action='store_true', help='give every invocation an empty profile')
+    parser.add_argument('--child')
+    # the invocations only need the stubs, keep their startup light
+    if '--child' in sys.argv:
+        return child(sys.argv[sys.argv.index('--child') + 1])
+    sys.path[:0] = [HERE]
+    import actions
+    import server
+    server.add_arguments(parser)
+    args = parser.parse_args()
+
+    plan = [(name, query) for name, query in actions.ACTIONS if not args.action or name in args.action]
+    stand_in = server.from_arguments(args).start()
+    shared = tempfile.mkdtemp(prefix='kodi-load-')
+    homes = [shared]
+    results = dict((name, []) for name, _ in plan)
+    errors = []
+    pending = list(range(args.invocations))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                idx = pending.pop(0)
+                home = shared
+                if args.fresh_profiles:
+                    home = tempfile.mkdtemp(prefix='kodi-load-')
+                    homes.append(home)
+            name, query = plan[idx % len(plan)]
+            wall, ok, detail = invoke(query, home, stand_in.settings())
+            with lock:
+                results[name].append((wall, ok))
+                if not ok:
+                    errors.append((name, detail))
+
+    start = time.time()
+    threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    stand_in.shutdown()
+    for home in homes:
+        shutil.rmtree(home, ignore_errors=True)
+
+    print('{:<12} {:>5} {:>6} {:>9} {:>9} {:>9}'.format('action', 'runs', 'failed', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, _ in plan:
+        walls = [wall for wall, _ in results[name]]
+        if not walls:
+            continue
+        print('{:<12} {:5d} {:6d} {:9.1f} {:9.1f} {:9.1f}'.format(
+            name, len(walls), sum(1 for _, ok in results[name] if not ok),
+            percentile(walls, 0.5) * 1000, percentile(walls, 0.95) * 1000, percentile(walls, 0.99) * 1000))
+    print('{} invocations in {:.1f}s, {:.1f}/s at concurrency {}'.format(args.invocations, elapsed,
+                                                                        args.invocations / elapsed,
+                                                                        args.concurrency))
+    print('stand-in answered {} ({} KiB)'.format(stand_in.statuses, stand_in.bytes // 1024))
+    for name, detail in errors[:5]:
+        print('failed {}: {}'.format(name, detail))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+    Offline replay of IMDb responses from benchmarks/fixtures.
+
+    ReplayAdapter is a requests transport adapter, mounted on the add-on's
+    shared session it answers every request from a fixture file, so the
+    whole fetch path (session, HTTP cache, parsing) runs as it would
+    against IMDb while calls and bytes are counted. benchmarks/server.py
+    serves the same answers over HTTP.
+"""
+
+import datetime
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+from six.moves import urllib
+from urllib3.response import HTTPResponse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def coming_soon(url, params):
+    year, month = re.search(r'(\d{4})-(\d{2})', url).groups()
+    today = datetime.date.today()
+    offset = (int(year) - today.year) * 12 + int(month) - today.month
+    return 'movies-coming-soon-{}.html'.format(offset % 4)
+
+
+def json_video(url, params):
+    # The recorded title stands in for every title, those with an even
+    # number have no trailer so searches see both cases
+    imdb = url.rstrip('/').split('/')[-1]
+    with open(os.path.join(FIXTURES, 'json-video.json')) as f:
+        data = json.load(f)
+    items = data['playlists']['tt0000001']
+    if int(re.sub(r'\D', '', imdb) or 0) % 2 == 0:
+        items = {'listItems': []}
+    data['playlists'] = {imdb: items}
+    return json.dumps(data).encode('utf-8')
+
+
+# Aliased categories of a batched query: alias -> (operation, field)
+BATCH_FIELDS = {'trending': ('TrendingTitles', 'trendingTitles'),
+                'anticipated': ('PopularTitles', 'popularTitles'),
+                'popular': ('PopularTitles', 'popularTitles'),
+                'recent': ('RecentVideos', 'recentVideos')}
+
+
+def graphql(url, params):
+    # Pages are recorded as graphql-<operation>-<page>.json, later pages
+    # are requested with the token the previous one returned: tok-<operation>-<page>
+    op = params['operationName'][0]
+    variables = json.loads(params['variables'][0])
+    if op not in [field[0] for field in BATCH_FIELDS.values()]:
+        return batch(variables)
+    token = re.search(r'tok-\w+-(\d+)', variables.get('paginationToken', ''))
+    return 'graphql-{}-{}.json'.format(op, token.group(1) if token else 0)
+
+
+def batch(variables):
+    # Batched queries alias every category by its key and suffix its
+    # variables with it, the answer is assembled from the single pages
+    data = {}
+    for alias, (op, field) in BATCH_FIELDS.items():
+        if 'limit_' + alias not in variables:
+            continue
+        token = re.search(r'tok-\w+-(\d+)', variables.get('paginationToken_' + alias, ''))
+        with open(os.path.join(FIXTURES, 'graphql-{}-{}.json'.format(op, token.group(1) if token else 0))) as f:
+            data[alias] = json.load(f)['data'][field]
+    return json.dumps({'data': data}).encode('utf-8')
+
+
+# (url pattern, fixture name or function returning one or a body, content type)
+ROUTES = [(r'/movies-in-theaters', 'movies-in-theaters.html', 'text/html'),
+          (r'/movies-coming-soon/', coming_soon, 'text/html'),
+          (r'/find\?', 'find.html', 'text/html'),
+          (r'graphql', graphql, 'application/json'),
+          (r'VIDEO_PLAYBACK_DATA', 'video-playback-data.json', 'application/json'),
+          (r'/_json/video/', json_video, 'application/json'),
+          (r'\.m3u8', 'hls-master.m3u8', 'application/x-mpegurl')]
+
+
+def route(url):
+    """
+    Return (fixture path or response body, content type) for url, or (None, None).
+    """
+    params = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    for pattern, name, content_type in ROUTES:
+        if re.search(pattern, url):
+            if callable(name):
+                name = name(url, params)
+            if isinstance(name, bytes):
+                return name, content_type
+            return os.path.join(FIXTURES, name), content_type
+    return None, None
+
+
+def load(url):
+    """
+    Return (status, body bytes, content type) for url.
+    """
+    path, content_type = route(url)
+    if isinstance(path, bytes):
+        return 200, path, content_type
+    if path is None or not os.path.exists(path):
+        return 404, b'Not Found', 'text/plain'
+    with open(path, 'rb') as f:
+        return 200, f.read(), content_type
+
+
+def respond(url, request_headers):
+    """
+    Return (status, response headers, body) answering a GET of url.
+    """
+    status, body, content_type = load(url)
+    headers = {'Content-Type': content_type}
+    # Pages carry an ETag like IMDb's HTML, the GraphQL API sends no validators
+    if status == 200 and content_type == 'text/html':
+        headers['ETag'] = '"{}"'.format(hashlib.sha1(body).hexdigest()[:16])
+        if request_headers.get('If-None-Match') == headers['ETag']:
+            status, body = 304, b''
+    headers['Content-Length'] = str(len(body))
+    return status, headers, body
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    requests transport adapter answering from the fixtures.
+    """
+    def __init__(self):
+        super(ReplayAdapter, self).__init__()
+        self.lock = threading.Lock()
+        self.calls = []
+        self.bytes = 0
+
+    def send(self, request, **kwargs):
+        status, headers, body = respond(request.url, request.headers)
+        with self.lock:
+            self.calls.append(request.url)
+            self.bytes += len(body)
+        raw = HTTPResponse(body=io.BytesIO(body), status=status, preload_content=False, headers=headers)
+        return HTTPAdapter().build_response(request, raw)
+
+    def close(self):
+        pass
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+    Local stand-in for IMDb serving the recorded fixtures over HTTP.
+
+    Answers the In Theaters and Coming Soon pages, searches, GraphQL
+    pages and batches, VIDEO_PLAYBACK_DATA, _json/video and HLS master
+    playlists like benchmarks/replay.py does, with the network conditions
+    to test against:
+
+        --latency MS     median time to first byte, log-normal with --jitter
+        --bandwidth KB   bytes per second per response, in KiB (0: unlimited)
+        --error-rate F   share of requests answered with a 503
+
+        python benchmarks/server.py [--port N] [--latency MS] [--jitter F]
+                                    [--bandwidth KB] [--error-rate F]
+
+    Point the add-on at it with its hidden settings, e.g. with the stubs:
+
+        KODI_STUB_SETTINGS=imdb_url=http://127.0.0.1:N,graphql_url=http://127.0.0.1:N/graphql/
+
+    Video URLs in the answers are rewritten to the stand-in as well, so
+    HLS master playlists are fetched from it.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [HERE]
+
+import replay  # noqa: E402
+
+VIDEO_HOST = b'https://imdb-video.media-imdb.com'
+CHUNK = 16 * 1024
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        base = 'http://{}:{}'.format(*server.server_address[:2])
+        delay = server.latency * random.lognormvariate(0, server.jitter) if server.latency else 0
+        time.sleep(delay)
+        if random.random() < server.error_rate:
+            status, headers, body = 503, {'Content-Type': 'text/plain'}, b'Service Unavailable'
+        else:
+            status, headers, body = replay.respond(base + self.path, self.headers)
+            body = body.replace(VIDEO_HOST, base.encode('ascii'))
+        headers['Content-Length'] = str(len(body))
+        server.count(status, len(body))
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        for start in range(0, len(body), CHUNK):
+            chunk = body[start:start + CHUNK]
+            self.wfile.write(chunk)
+            if server.bandwidth:
+                time.sleep(len(chunk) / float(server.bandwidth))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandIn(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    The stand-in server, counting the requests it answered by status.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, latency=0, jitter=0.5, bandwidth=0, error_rate=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.latency = latency / 1000.0
+        self.jitter = jitter
+        self.bandwidth = bandwidth * 1024
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.statuses = {}
+        self.bytes = 0
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def settings(self):
+        """
+        KODI_STUB_SETTINGS pointing the add-on at this server.
+        """
+        return 'imdb_url={0},graphql_url={0}/graphql/'.format(self.url)
+
+    def count(self, status, size):
+        with self.lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.bytes += size
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+
+def add_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0, help='median latency in ms')
+    parser.add_argument('--jitter', type=float, default=0.5, help='sigma of the log-normal latency')
+    parser.add_argument('--bandwidth', type=float, default=0, help='KiB per second per response')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests answered with a 503')
+
+
+def from_arguments(args, port=0):
+    return StandIn(port, args.latency, args.jitter, args.bandwidth, args.error_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8642)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = from_arguments(args, args.port)
+    print('serving on {}'.format(server.url))
+    print('KODI_STUB_SETTINGS={}'.format(server.settings()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print('answered {} ({} KiB)'.format(server.statuses, server.bytes // 1024))
+
+
+if __name__ == '__main__':
+    main()
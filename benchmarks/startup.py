@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+    Plugin startup benchmark.
+
+    Every action is run in a fresh interpreter, the way Kodi runs the
+    plugin, and the script reports how long importing the add-on took,
+    how long until the first result was handed back to Kodi and which of
+    the heavy dependencies got loaded along the way.
+
+    Network access is replaced by tiny canned responses so the numbers
+    only reflect the add-on's own startup cost.
+
+        python benchmarks/startup.py [--runs N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+PLUGIN = 'plugin://plugin.video.imdb.trailers/'
+
+ACTIONS = [('main_menu', ''),
+           ('showing', '?action=list2&key=showing'),
+           ('coming', '?action=list2&key=coming'),
+           ('trending', '?action=list3&key=trending'),
+           ('recent', '?action=list3&key=recent'),
+           ('search', '?action=search'),
+           ('play', '?action=play&videoid=vi0000000001'),
+           ('play_id', '?action=play_id&imdb=tt0000001')]
+
+HEAVY = ['requests', 'bs4', 'lxml', 'sqlite3']
+
+
+class Response(object):
+    status_code = 200
+
+    def __init__(self, text):
+        self.text = text
+        self.content = text.encode('utf-8')
+        self.headers = {}
+        self.digest = None
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def canned(url):
+    if 'graphql' in url:
+        field = 'recentVideos' if 'RecentVideos' in url else 'popularTitles' if 'PopularTitles' in url else 'trendingTitles'
+        items = 'videos' if field == 'recentVideos' else 'titles'
+        return Response(json.dumps({'data': {field: {items: [], 'paginationToken': None}}}))
+    if 'VIDEO_PLAYBACK_DATA' in url:
+        return Response('[{"definition":"480p","mimeType":"video/mp4","url":"https://example.invalid/v.mp4"}]')
+    if '_json/video' in url:
+        imdb = url.rstrip('/').split('/')[-1]
+        return Response(json.dumps({'playlists': {imdb: {'listItems': []}}}))
+    return Response('<html><body></body></html>')
+
+
+def child(query):
+    sys.path[:0] = [os.path.join(HERE, 'stubs'), ROOT]
+    sys.argv = [PLUGIN, '1', query]
+    before = set(sys.modules)
+
+    start = time.time()
+    from resources.lib import imdb_trailers
+    imported = time.time()
+    imdb_trailers.fetch = canned
+
+    import xbmcgui
+    import xbmcplugin
+    imdb_trailers.Main()
+    events = sorted(xbmcplugin.events + xbmcgui.notifications)
+    loaded = set(sys.modules) - before
+
+    print(json.dumps({'import': imported - start,
+                      'first': (events[0][0] - imported) if events else None,
+                      'total': time.time() - start,
+                      'modules': [name for name in HEAVY if name in loaded]}))
+
+
+def run(query):
+    home = tempfile.mkdtemp(prefix='kodi-stub-')
+    try:
+        env = dict(os.environ, KODI_STUB_HOME=home, KODI_STUB_KEYBOARD='matrix')
+        out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', query], env=env)
+        return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def ms(value):
+    return '{:8.1f}'.format(value * 1000) if value is not None else '       -'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child')
+    args = parser.parse_args()
+
+    if args.child is not None:
+        return child(args.child)
+
+    print('{:<10} {:>8} {:>8} {:>8}  {}'.format('action', 'import', 'first', 'total', 'heavy modules loaded'))
+    for name, query in ACTIONS:
+        results = [run(query) for _ in range(args.runs)]
+        first = [r['first'] for r in results if r['first'] is not None]
+        print('{:<10} {} {} {}  {}'.format(name,
+                                           ms(median([r['import'] for r in results])),
+                                           ms(median(first) if first else None),
+                                           ms(median([r['total'] for r in results])),
+                                           ', '.join(results[-1]['modules']) or '-'))
+    print('times in ms, median of {} cold runs'.format(args.runs))
+
+
+if __name__ == '__main__':
+    main()
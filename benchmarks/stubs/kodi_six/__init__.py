@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+    kodi_six on top of the stub modules, the add-on only uses the re-exports.
+"""
+
+import xbmc  # noqa: F401
+import xbmcaddon  # noqa: F401
+import xbmcgui  # noqa: F401
+import xbmcplugin  # noqa: F401
+import xbmcvfs  # noqa: F401
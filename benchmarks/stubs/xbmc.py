@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+    Minimal stand-in for Kodi's xbmc module, enough to run the add-on
+    outside of Kodi for benchmarking.
+"""
+
+import os
+import tempfile
+
+LOGDEBUG = 0
+LOGINFO = 1
+LOGNOTICE = 2
+LOGWARNING = 3
+LOGERROR = 4
+
+HOME = os.environ.get('KODI_STUB_HOME') or tempfile.mkdtemp(prefix='kodi-stub-')
+messages = []
+
+
+def log(msg, level=LOGDEBUG):
+    messages.append((level, msg))
+    if os.environ.get('KODI_STUB_LOG'):
+        print(msg)
+
+
+def translatePath(path):
+    for special, folder in (('special://profile/', 'userdata'),
+                            ('special://temp/', 'temp'),
+                            ('special://home/', '')):
+        if path.startswith(special):
+            return os.path.join(HOME, folder, path[len(special):])
+    return path
+
+
+def executebuiltin(function, wait=False):
+    pass
+
+
+def executeJSONRPC(request):
+    return '{"id": 1, "jsonrpc": "2.0", "result": {}}'
+
+
+def getInfoLabel(label):
+    return ''
+
+
+def getInfoImage(label):
+    return ''
+
+
+def getCondVisibility(condition):
+    # System.HasAddon() is true for the add-ons listed in KODI_STUB_ADDONS
+    addons = os.environ.get('KODI_STUB_ADDONS', '').split(',')
+    return condition.startswith('System.HasAddon(') and condition[16:-1] in addons
+
+
+def getGlobalIdleTime():
+    return 0
+
+
+def sleep(msec):
+    pass
+
+
+class Monitor(object):
+    def abortRequested(self):
+        return False
+
+    def waitForAbort(self, timeout=0):
+        return True
+
+
+class Player(object):
+    def isPlaying(self):
+        return False
+
+
+class Keyboard(object):
+    def __init__(self, line='', heading='', hidden=False):
+        self.text = os.environ.get('KODI_STUB_KEYBOARD', line)
+
+    def setHeading(self, heading):
+        pass
+
+    def doModal(self, autoclose=0):
+        pass
+
+    def isConfirmed(self):
+        return True
+
+    def getText(self):
+        return self.text
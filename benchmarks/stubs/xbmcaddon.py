@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+    Minimal stand-in for Kodi's xbmcaddon module. Settings start from the
+    defaults in resources/settings.xml and can be overridden with
+    KODI_STUB_SETTINGS="id=value,id=value".
+"""
+
+import os
+import re
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ADDON_ID = re.search(r'<addon id="([^"]+)"', open(os.path.join(ROOT, 'addon.xml')).read()).group(1)
+
+
+def _defaults():
+    data = open(os.path.join(ROOT, 'resources', 'settings.xml')).read()
+    settings = dict(re.findall(r'<setting id="([^"]+)"[^>]*?default="([^"]*)"', data))
+    for pair in os.environ.get('KODI_STUB_SETTINGS', '').split(','):
+        if '=' in pair:
+            key, value = pair.split('=', 1)
+            settings[key] = value
+    return settings
+
+
+settings = _defaults()
+
+
+class Addon(object):
+    def __init__(self, id=None):
+        self.info = {'id': ADDON_ID,
+                     'name': 'IMDb Trailers',
+                     'version': 'stub',
+                     'icon': os.path.join(ROOT, 'icon.png'),
+                     'fanart': os.path.join(ROOT, 'fanart.jpg'),
+                     'path': ROOT,
+                     'profile': 'special://profile/addon_data/{}/'.format(ADDON_ID)}
+
+    def getAddonInfo(self, key):
+        return self.info[key]
+
+    def getLocalizedString(self, id):
+        return 'string {}'.format(id)
+
+    def getSetting(self, id):
+        return settings.get(id, '')
+
+    def setSetting(self, id, value):
+        settings[id] = value
+
+    def openSettings(self):
+        pass
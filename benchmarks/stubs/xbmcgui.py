@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+    Minimal stand-in for Kodi's xbmcgui module.
+"""
+
+import json as _json
+import os as _os
+import time as _time
+
+notifications = []
+
+
+class ListItem(object):
+    def __init__(self, label='', label2='', path='', offscreen=False):
+        self.label = label
+        self.path = path
+        self.art = {}
+        self.info = {}
+        self.properties = {}
+
+    def setArt(self, values):
+        self.art.update(values)
+
+    def setInfo(self, type, infoLabels):
+        self.info.update(infoLabels)
+
+    def setProperty(self, key, value):
+        self.properties[key] = value
+
+    def getProperty(self, key):
+        return self.properties.get(key, '')
+
+    def setPath(self, path):
+        self.path = path
+
+    def setMimeType(self, mimetype):
+        self.properties['mimetype'] = mimetype
+
+    def setContentLookup(self, enable):
+        pass
+
+
+class Dialog(object):
+    def notification(self, heading, message, icon='', time=5000, sound=True):
+        notifications.append((_time.time(), message))
+
+
+class Window(object):
+    """
+    Window properties, those of the home window (10000) are kept in a file
+    of the stub home so a service and plugin runs in other processes share
+    them as they do in Kodi.
+    """
+    def __init__(self, existingWindowId=-1):
+        import xbmc
+        self.path = _os.path.join(xbmc.HOME, 'window-{}.json'.format(existingWindowId))
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return _json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def getProperty(self, key):
+        return self.load().get(key, '')
+
+    def setProperty(self, key, value):
+        properties = self.load()
+        properties[key] = value
+        with open(self.path, 'w') as f:
+            _json.dump(properties, f)
+
+    def clearProperty(self, key):
+        properties = self.load()
+        properties.pop(key, None)
+        with open(self.path, 'w') as f:
+            _json.dump(properties, f)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+    Minimal stand-in for Kodi's xbmcplugin module. Every call that hands a
+    result back to Kodi is recorded with its time in events.
+"""
+
+import time
+
+SORT_METHOD_NONE = 0
+SORT_METHOD_UNSORTED = 40
+SORT_METHOD_VIDEO_TITLE = 26
+
+events = []
+items = []
+resolved = []
+
+
+def addDirectoryItem(handle, url, listitem, isFolder=False, totalItems=0):
+    events.append((time.time(), 'addDirectoryItem'))
+    items.append((url, listitem, isFolder))
+    return True
+
+
+def addDirectoryItems(handle, items_, totalItems=0):
+    events.append((time.time(), 'addDirectoryItems'))
+    items.extend(items_)
+    return True
+
+
+def endOfDirectory(handle, succeeded=True, updateListing=False, cacheToDisc=True):
+    events.append((time.time(), 'endOfDirectory'))
+
+
+def setResolvedUrl(handle, succeeded, listitem):
+    events.append((time.time(), 'setResolvedUrl'))
+    resolved.append(listitem)
+
+
+def addSortMethod(handle, sortMethod, label2Mask=''):
+    pass
+
+
+def setContent(handle, content):
+    pass
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+    Minimal stand-in for Kodi's xbmcvfs module.
+"""
+
+import os
+from xbmc import translatePath  # noqa: F401
+
+
+def exists(path):
+    return os.path.exists(translatePath(path))
+
+
+def mkdir(path):
+    if not exists(path):
+        os.makedirs(translatePath(path))
+    return True
+
+
+mkdirs = mkdir
+
+
+def delete(path):
+    if exists(path):
+        os.remove(translatePath(path))
+    return True
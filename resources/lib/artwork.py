@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+    IMDB Trailers Kodi Addon
+    Copyright (C) 2018 gujal
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+from six.moves import urllib
+
+# IMDb image URL: the image id, then optional scaling/cropping modifiers
+# (._V1_UY209_CR0,0,140,209_AL_.jpg), without them it is the original
+IMDB_IMAGE = re.compile(r'^(https?://m\.media-amazon\.com/images/M/[^_/]+?)\.(?:_[^/]*_\.)?(jpg|png)$')
+# Width in pixels requested per art slot, by the kind of view showing the
+# listing. thumb and poster share their size so Kodi caches one texture.
+ART_WIDTHS = {'list': {'thumb': 300, 'poster': 300, 'fanart': 1920},
+              'wall': {'thumb': 500, 'poster': 500, 'fanart': 1920}}
+# Estuary views showing small thumbnails (List, WideList), the others show posters
+LIST_VIEWS = (50, 55)
+
+
+def resize(url, width):
+    """
+    Return the IMDb image url scaled down to width pixels, other URLs as they are.
+    """
+    match = IMDB_IMAGE.match(url or '')
+    if not match:
+        return url
+    return '{}._V1_QL75_UX{}_.{}'.format(match.group(1), width, match.group(2))
+
+
+def view_type(view_mode=None, label=''):
+    """
+    'list' or 'wall' for a view id, else for the label of the current view.
+    """
+    if view_mode is not None:
+        return 'list' if view_mode in LIST_VIEWS else 'wall'
+    return 'list' if 'list' in label.lower() else 'wall'
+
+
+def art(poster, fanart, view='wall', screen_width=0):
+    """
+    Art dict of a listing item with every image sized for its slot,
+    fanart no wider than the screen.
+    """
+    widths = ART_WIDTHS[view]
+    fanart_width = min(widths['fanart'], screen_width) if screen_width > 0 else widths['fanart']
+    thumb = resize(poster, widths['thumb'])
+    return {'thumb': thumb,
+            'icon': thumb,
+            'poster': resize(poster, widths['poster']),
+            'fanart': resize(fanart, fanart_width)}
+
+
+def texture_url(server, url):
+    """
+    URL of image url on Kodi's web server, requesting it loads it into the texture cache.
+    """
+    image = 'image://{}/'.format(urllib.parse.quote(url, safe=''))
+    return '{}/image/{}'.format(server, urllib.parse.quote(image, safe=''))
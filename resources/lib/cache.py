@@ -0,0 +1,505 @@
+# -*- coding: utf-8 -*-
+"""
+    IMDB Trailers Kodi Addon
+    Copyright (C) 2018 gujal
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import contextlib
+import difflib
+import json
+import re
+import sqlite3
+import time
+import zlib
+
+# zstd is smaller and faster to decompress, zlib is always there
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def words(text):
+    return re.findall(r'\w+', text.lower(), re.UNICODE)
+
+
+def dumps(obj):
+    # Records of the GraphQL listings (parsers.Record) are stored as plain dicts
+    return sqlite3.Binary(zlib.compress(json.dumps(obj, separators=(',', ':'),
+                                                   default=lambda record: record.to_dict()).encode('utf-8')))
+
+
+def loads(blob):
+    return json.loads(zlib.decompress(bytes(blob)).decode('utf-8'))
+
+
+def compress(body):
+    """
+    Return (codec, compressed body) with the best codec available.
+    """
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=3).compress(body)
+    return 'zlib', zlib.compress(body, 6)
+
+
+def decompress(codec, blob):
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(blob)
+    if codec == 'zlib':
+        return zlib.decompress(blob)
+    return blob
+
+
+class SqliteCache(object):
+    def __init__(self, path):
+        self.path = path
+
+    @contextlib.contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def compact(self, ratio=0.25):
+        """
+        VACUUM the database when more than ratio of its pages are unused,
+        return whether it did. Meant for idle time, it rewrites the whole file.
+        """
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            pages = conn.execute('PRAGMA page_count').fetchone()[0]
+            if not pages or free <= pages * ratio:
+                return False
+            conn.execute('VACUUM')
+            return True
+        finally:
+            conn.close()
+
+    @staticmethod
+    def add_columns(conn, table, columns):
+        """
+        Add the (name, type) columns missing from a table created by an older version.
+        """
+        existing = [row[1] for row in conn.execute('PRAGMA table_info({})'.format(table))]
+        for name, column_type in columns:
+            if name not in existing:
+                conn.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(table, name, column_type))
+
+
+class RecordCache(SqliteCache):
+    """
+    Second cache tier holding the normalized listing records per category,
+    so a warm listing skips both the network and the HTML/JSON parsing.
+    Records are stored once per videoId (or IMDb id for search results,
+    which have no videoId) and shape, and shared by every category that
+    lists them.
+    A listing can be a single page of a category, stored with the token of
+    the next page, or a single month of coming soon.
+
+    Every title stored also goes into a search index that outlives the
+    listings, see search(). It uses SQLite's FTS5 when the library has it
+    and plain LIKE matching when it does not.
+    """
+    # Titles kept in the search index, the ones seen last
+    MAX_TITLES = 5000
+
+    def __init__(self, path, expire_after):
+        super(RecordCache, self).__init__(path)
+        self.expire_after = expire_after
+        with self.connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS titles (id TEXT UNIQUE, title TEXT, data BLOB, seen REAL)')
+            self.fts = self.create_fts(conn)
+            conn.execute('CREATE TABLE IF NOT EXISTS records (id TEXT PRIMARY KEY, data BLOB)')
+            conn.execute('CREATE TABLE IF NOT EXISTS listings (key TEXT PRIMARY KEY, created REAL, next_token TEXT, '
+                         'expires REAL, digest TEXT)')
+            self.add_columns(conn, 'listings', [('next_token', 'TEXT'), ('expires', 'REAL'), ('digest', 'TEXT')])
+            conn.execute('CREATE TABLE IF NOT EXISTS listing_items (key TEXT, pos INTEGER, id TEXT, PRIMARY KEY (key, pos))')
+
+    @staticmethod
+    def create_fts(conn):
+        try:
+            conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS titles_fts USING fts5(title, content=titles, '
+                         'content_rowid=rowid, tokenize="unicode61 remove_diacritics 2")')
+        except sqlite3.OperationalError:
+            # no FTS5 in this sqlite
+            return False
+        conn.execute('CREATE TRIGGER IF NOT EXISTS titles_ai AFTER INSERT ON titles BEGIN '
+                     'INSERT INTO titles_fts (rowid, title) VALUES (new.rowid, new.title); END')
+        conn.execute('CREATE TRIGGER IF NOT EXISTS titles_ad AFTER DELETE ON titles BEGIN '
+                     "INSERT INTO titles_fts (titles_fts, rowid, title) VALUES ('delete', old.rowid, old.title); END")
+        conn.execute('CREATE TRIGGER IF NOT EXISTS titles_au AFTER UPDATE OF title ON titles BEGIN '
+                     "INSERT INTO titles_fts (titles_fts, rowid, title) VALUES ('delete', old.rowid, old.title); "
+                     'INSERT INTO titles_fts (rowid, title) VALUES (new.rowid, new.title); END')
+        return True
+
+    @staticmethod
+    def record_id(record):
+        # The HTML pages, GraphQL and search give records of different
+        # fields for one video, each shape gets its own row
+        fields = record if isinstance(record, dict) else record.to_dict()
+        shape = zlib.crc32(','.join(sorted(fields)).encode('ascii')) & 0xffffffff
+        return '{}:{:08x}'.format(fields.get('videoId') or fields.get('imdb'), shape)
+
+    def get(self, key):
+        """
+        Return the cached records for key, or None if missing or expired.
+        """
+        page = self.get_page(key)
+        return page[0] if page is not None else None
+
+    def get_page(self, key):
+        """
+        Return (records, next page token) cached for key, or None if missing or expired.
+        """
+        with self.connect() as conn:
+            row = conn.execute('SELECT expires, next_token FROM listings WHERE key = ?', (key,)).fetchone()
+            if row is None or not row[0] or row[0] < time.time():
+                return None
+            rows = conn.execute('SELECT r.data FROM listing_items i JOIN records r ON r.id = i.id '
+                                'WHERE i.key = ? ORDER BY i.pos', (key,)).fetchall()
+        return [loads(data) for data, in rows], row[1]
+
+    def expired(self, key):
+        with self.connect() as conn:
+            row = conn.execute('SELECT expires FROM listings WHERE key = ?', (key,)).fetchone()
+        return row is None or not row[0] or row[0] < time.time()
+
+    def reuse(self, key, digest, expire_after=None):
+        """
+        Return (records, next page token) of key, also when expired, if they
+        were parsed from the response with this digest, else None. Their
+        lifetime is renewed for expire_after seconds when it is given.
+        """
+        if not digest:
+            return None
+        with self.connect() as conn:
+            row = conn.execute('SELECT digest FROM listings WHERE key = ?', (key,)).fetchone()
+            if row is None or row[0] != digest:
+                return None
+            if expire_after:
+                conn.execute('UPDATE listings SET expires = ? WHERE key = ?', (time.time() + expire_after, key))
+            row = conn.execute('SELECT next_token FROM listings WHERE key = ?', (key,)).fetchone()
+            rows = conn.execute('SELECT r.data FROM listing_items i JOIN records r ON r.id = i.id '
+                                'WHERE i.key = ? ORDER BY i.pos', (key,)).fetchall()
+        return [loads(data) for data, in rows], row[0]
+
+    def set(self, key, records, next_token=None, expire_after=None, digest=None):
+        """
+        Store the records of key for expire_after seconds, by default the lifetime
+        the cache was opened with. digest identifies the response they were parsed from.
+        """
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute('DELETE FROM listing_items WHERE key = ?', (key,))
+            conn.executemany('INSERT OR REPLACE INTO records (id, data) VALUES (?, ?)',
+                             [(self.record_id(r), dumps(r)) for r in records])
+            conn.executemany('INSERT OR REPLACE INTO listing_items (key, pos, id) VALUES (?, ?, ?)',
+                             [(key, pos, self.record_id(r)) for pos, r in enumerate(records)])
+            conn.execute('INSERT OR REPLACE INTO listings (key, created, next_token, expires, digest) '
+                         'VALUES (?, ?, ?, ?, ?)',
+                         (key, now, next_token, now + (expire_after or self.expire_after), digest))
+            self.prune(conn)
+            self.index(conn, records, now)
+
+    def index(self, conn, records, now):
+        # Titles are keyed by IMDb id when known, so a title listed by
+        # several categories or found by a search is indexed once
+        for record in records:
+            title = record.get('title')
+            if not title:
+                continue
+            title_id = record.get('imdb') or record.get('videoId')
+            data = dumps(record)
+            if not conn.execute('UPDATE titles SET title = ?, data = ?, seen = ? WHERE id = ?',
+                                (title, data, now, title_id)).rowcount:
+                conn.execute('INSERT INTO titles (id, title, data, seen) VALUES (?, ?, ?, ?)',
+                             (title_id, title, data, now))
+        conn.execute('DELETE FROM titles WHERE rowid IN (SELECT rowid FROM titles ORDER BY seen DESC '
+                     'LIMIT -1 OFFSET ?)', (self.MAX_TITLES,))
+
+    def search(self, query, limit=50):
+        """
+        Return (records, whole) of the indexed titles with words starting
+        with every word of query, best match first. The ones made of
+        exactly the words of the query (whole is True when there are any)
+        come before the others.
+        """
+        query_words = words(query)
+        if not query_words:
+            return [], False
+        with self.connect() as conn:
+            if self.fts:
+                rows = conn.execute('SELECT t.data FROM titles_fts JOIN titles t ON t.rowid = titles_fts.rowid '
+                                    'WHERE titles_fts MATCH ? ORDER BY rank LIMIT ?',
+                                    (' '.join('"{}"*'.format(word) for word in query_words), limit)).fetchall()
+            else:
+                rows = conn.execute('SELECT data FROM titles WHERE {} ORDER BY seen DESC LIMIT ?'.format(
+                                    ' AND '.join(['title LIKE ?'] * len(query_words))),
+                                    ['%{}%'.format(word) for word in query_words] + [limit]).fetchall()
+        records = [loads(data) for data, in rows]
+        whole = [record for record in records if words(record.get('title') or '') == query_words]
+        return whole + [record for record in records if record not in whole], bool(whole)
+
+    def similar(self, query, limit=50, cutoff=0.75):
+        """
+        Return the indexed titles closest to query, best first, to catch
+        typos. A title scores the mean over the query words of how close
+        its closest word is. The cheap upper bounds of difflib are worked
+        out once per distinct title word, the exact closeness only for the
+        words of titles those bounds let reach cutoff.
+        """
+        query_words = words(query)
+        if not query_words:
+            return []
+        with self.connect() as conn:
+            titles = [(rowid, words(title)) for rowid, title in conn.execute('SELECT rowid, title FROM titles')]
+        vocabulary = set(word for _, title_words in titles for word in title_words)
+        # the closeness a word needs for its title to reach cutoff when all other words match fully
+        floor = cutoff * len(query_words) - (len(query_words) - 1)
+        matchers = []
+        for word in query_words:
+            # SequenceMatcher caches what it learns about its second sequence
+            matcher = difflib.SequenceMatcher(None, '', word)
+            bounds = {}
+            for candidate in vocabulary:
+                matcher.set_seq1(candidate)
+                if matcher.real_quick_ratio() >= floor:
+                    bound = matcher.quick_ratio()
+                    if bound and bound >= floor:
+                        bounds[candidate] = bound
+            matchers.append((matcher, bounds, {}))
+
+        def closeness(title_word, matcher, bounds, ratios):
+            if title_word not in bounds:
+                return 0
+            if title_word not in ratios:
+                matcher.set_seq1(title_word)
+                ratios[title_word] = matcher.ratio()
+            return ratios[title_word]
+
+        scored = []
+        needed = cutoff * len(query_words)
+        for rowid, title_words in titles:
+            if not title_words:
+                continue
+            if sum(max(bounds.get(title_word, 0) for title_word in title_words)
+                   for _, bounds, _ in matchers) < needed:
+                continue
+            total = sum(max(closeness(title_word, *matcher) for title_word in title_words) for matcher in matchers)
+            if total >= needed:
+                scored.append((total / len(query_words), rowid))
+        scored.sort(key=lambda item: -item[0])
+        rowids = [rowid for _, rowid in scored[:limit]]
+        if not rowids:
+            return []
+        with self.connect() as conn:
+            data = dict(conn.execute('SELECT rowid, data FROM titles WHERE rowid IN ({})'.format(
+                ', '.join('?' * len(rowids))), rowids).fetchall())
+        return [loads(data[rowid]) for rowid in rowids]
+
+    def prune(self, conn):
+        # Expired listings are kept for another lifetime so they can be reused
+        expired = time.time() - self.expire_after
+        conn.execute('DELETE FROM listing_items WHERE key IN '
+                     '(SELECT key FROM listings WHERE expires IS NULL OR expires < ?)', (expired,))
+        conn.execute('DELETE FROM listings WHERE expires IS NULL OR expires < ?', (expired,))
+        conn.execute('DELETE FROM records WHERE id NOT IN (SELECT id FROM listing_items)')
+
+    def clear(self):
+        with self.connect() as conn:
+            conn.execute('DELETE FROM listing_items')
+            conn.execute('DELETE FROM listings')
+            conn.execute('DELETE FROM records')
+            conn.execute('DELETE FROM titles')
+
+
+class StreamCache(SqliteCache):
+    """
+    Resolved playback URLs keyed by video (or IMDb) id and quality, each
+    kept until shortly before its signed URL stops being valid.
+    """
+    def __init__(self, path):
+        super(StreamCache, self).__init__(path)
+        with self.connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS streams (id TEXT, quality INTEGER, url TEXT, expires REAL, '
+                         'PRIMARY KEY (id, quality))')
+
+    def get(self, id, quality):
+        with self.connect() as conn:
+            row = conn.execute('SELECT url FROM streams WHERE id = ? AND quality = ? AND expires > ?',
+                               (id, quality, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, id, quality, url, expires):
+        with self.connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO streams (id, quality, url, expires) VALUES (?, ?, ?, ?)',
+                         (id, quality, url, expires))
+            conn.execute('DELETE FROM streams WHERE expires < ?', (time.time(),))
+
+    def clear(self):
+        with self.connect() as conn:
+            conn.execute('DELETE FROM streams')
+
+
+class Entry(object):
+    """
+    A cached response. The body is only decompressed when first used,
+    length is its decompressed size and digest its SHA-1.
+    """
+    __slots__ = ('status', 'encoding', 'headers', 'expires', 'keep_until', 'digest', 'length', 'codec', 'blob', '_body')
+
+    def __init__(self, status, encoding, headers, expires, keep_until, digest, length, codec, blob):
+        self.status = status
+        self.encoding = encoding
+        self.headers = headers
+        self.expires = expires
+        self.keep_until = keep_until
+        self.digest = digest
+        self.length = length
+        self.codec = codec
+        self.blob = blob
+        self._body = None
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = decompress(self.codec, bytes(self.blob))
+            self.blob = None
+        return self._body
+
+
+class BodyReader(object):
+    """
+    File object handing the body of an Entry to requests as Response.raw,
+    so it is decompressed when the response content is read, not before.
+    """
+    def __init__(self, entry):
+        self.entry = entry
+        self.done = False
+
+    def read(self, amt=None):
+        if self.done:
+            return b''
+        self.done = True
+        return self.entry.body
+
+
+class HttpCache(SqliteCache):
+    """
+    HTTP responses by URL. Every entry carries the time it expires and the
+    time until which it may still be served stale while being refreshed,
+    both set by the caller per URL class. Entries past both are kept for
+    their validators until evicted: once the stored bodies exceed max_size
+    bytes the least recently used entries go. Bodies are stored compressed
+    unless compression is turned off.
+    """
+    def __init__(self, path, max_size, compression=True):
+        super(HttpCache, self).__init__(path)
+        self.max_size = max_size
+        self.compression = compression
+        with self.connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, status INTEGER, encoding TEXT, '
+                         'headers TEXT, body BLOB, size INTEGER, expires REAL, keep_until REAL, accessed REAL, '
+                         'digest TEXT, length INTEGER, codec TEXT)')
+            self.add_columns(conn, 'responses', [('digest', 'TEXT'), ('length', 'INTEGER'), ('codec', 'TEXT')])
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+            conn.execute('CREATE TABLE IF NOT EXISTS hosts (host TEXT PRIMARY KEY, latencies TEXT, failures INTEGER, '
+                         'opened_until REAL)')
+
+    def get(self, url):
+        """
+        Return the Entry cached for url, or None.
+        """
+        now = time.time()
+        with self.connect() as conn:
+            row = conn.execute('SELECT status, encoding, headers, expires, keep_until, digest, length, codec, body '
+                               'FROM responses WHERE url = ?', (url,)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE responses SET accessed = ? WHERE url = ?', (now, url))
+        if row is None:
+            return None
+        status, encoding, headers, expires, keep_until, digest, length, codec, blob = row
+        if codec == 'zstd' and zstandard is None:
+            return None
+        return Entry(status, encoding, json.loads(headers), expires, keep_until, digest,
+                     length if length is not None else len(blob), codec, blob)
+
+    def set(self, url, status, encoding, headers, body, expires, keep_until, digest):
+        headers = json.dumps(headers, separators=(',', ':'))
+        codec, blob = compress(body) if self.compression else (None, body)
+        with self.connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO responses (url, status, encoding, headers, body, size, expires, '
+                         'keep_until, accessed, digest, length, codec) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (url, status, encoding, headers, sqlite3.Binary(blob), len(blob) + len(headers),
+                          expires, keep_until, time.time(), digest, len(body), codec))
+            self.evict(conn)
+
+    def renew(self, url, expires, keep_until):
+        """
+        Extend the lifetime of an entry the server confirmed unchanged.
+        """
+        with self.connect() as conn:
+            conn.execute('UPDATE responses SET expires = ?, keep_until = ?, accessed = ? WHERE url = ?',
+                         (expires, keep_until, time.time(), url))
+
+    def count(self, **counters):
+        with self.connect() as conn:
+            for name, value in counters.items():
+                conn.execute('INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)', (name,))
+                conn.execute('UPDATE counters SET value = value + ? WHERE name = ?', (value, name))
+
+    def counters(self):
+        with self.connect() as conn:
+            return dict(conn.execute('SELECT name, value FROM counters'))
+
+    def get_host(self, host):
+        """
+        Return (latencies, failures, opened_until) stored for host, or None. See network.Host.
+        """
+        with self.connect() as conn:
+            row = conn.execute('SELECT latencies, failures, opened_until FROM hosts WHERE host = ?',
+                               (host,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1], row[2]
+
+    def set_host(self, host, latencies, failures, opened_until):
+        with self.connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO hosts (host, latencies, failures, opened_until) VALUES (?, ?, ?, ?)',
+                         (host, json.dumps(latencies), failures, opened_until))
+
+    def evict(self, conn):
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_size:
+            return
+        # Make some room at once instead of evicting on every store
+        evicted = []
+        for url, size in conn.execute('SELECT url, size FROM responses ORDER BY accessed'):
+            if total <= self.max_size * 0.8:
+                break
+            evicted.append((url,))
+            total -= size
+        conn.executemany('DELETE FROM responses WHERE url = ?', evicted)
+
+    def clear(self):
+        with self.connect() as conn:
+            conn.execute('DELETE FROM responses')
+            conn.execute('DELETE FROM counters')
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+    IMDB Trailers Kodi Addon
+    Copyright (C) 2018 gujal
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+from six.moves import urllib
+
+# One attribute of an attribute list, quoted strings may contain commas
+ATTRIBUTE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+class Variant(object):
+    """
+    One #EXT-X-STREAM-INF entry of a master playlist.
+    """
+    __slots__ = ('uri', 'bandwidth', 'average_bandwidth', 'width', 'height', 'codecs', 'frame_rate')
+
+    def __init__(self, uri, attrs):
+        self.uri = uri
+        self.bandwidth = int(attrs.get('BANDWIDTH', 0))
+        self.average_bandwidth = int(attrs.get('AVERAGE-BANDWIDTH', 0)) or self.bandwidth
+        try:
+            self.width, self.height = [int(n) for n in attrs['RESOLUTION'].lower().split('x')]
+        except (KeyError, ValueError):
+            self.width = self.height = 0
+        self.codecs = [codec.strip() for codec in attrs['CODECS'].split(',')] if 'CODECS' in attrs else []
+        self.frame_rate = float(attrs.get('FRAME-RATE', 0))
+
+    def __repr__(self):
+        return 'Variant({}p {}bps {})'.format(self.height, self.bandwidth, self.uri)
+
+
+def attributes(text):
+    return dict((name, value[1:-1] if value.startswith('"') else value)
+                for name, value in ATTRIBUTE.findall(text))
+
+
+def parse_master(text, url):
+    """
+    Return the variants of the master playlist text fetched from url,
+    with their URIs made absolute, highest bandwidth first. A media
+    playlist has no variants and gives an empty list.
+    """
+    variants = []
+    attrs = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            attrs = attributes(line[len('#EXT-X-STREAM-INF:'):])
+        elif line.startswith('#'):
+            continue
+        elif attrs is not None:
+            variants.append(Variant(urllib.parse.urljoin(url, line), attrs))
+            attrs = None
+    variants.sort(key=lambda variant: variant.bandwidth, reverse=True)
+    return variants
+
+
+def select(variants, quality):
+    """
+    Best variant not taller than quality (a video height like 720),
+    or the smallest one if all of them are. Variants without a
+    RESOLUTION (audio only, or not telling) are only picked when no
+    other is left.
+    """
+    variants = [variant for variant in variants if variant.height] or variants
+    for variant in variants:
+        if variant.height <= quality:
+            return variant
+    return variants[-1] if variants else None
@@ -24,19 +24,16 @@ import datetime
 import json
 from kodi_six import xbmc, xbmcgui, xbmcplugin, xbmcaddon, xbmcvfs
 import base64
-from bs4 import BeautifulSoup, SoupStrainer
-import requests
-import requests_cache
+import collections
+import hashlib
+import threading
+import time
 import six
 from six.moves import urllib
-
-# HTMLParser() depreciated in Python 3.4 and removed in Python 3.9
-if sys.version_info >= (3,4,0):
-    import html
-    _html_parser = html
-else:
-    from six.moves import html_parser
-    _html_parser = html_parser.HTMLParser()
+from resources.lib import artwork, hls, parsers, tracing
+# requests, bs4/lxml and sqlite3 are imported on first use,
+# Kodi starts a fresh interpreter for every click and most actions need
+# only some of them (the main menu needs none)
 
 # DEBUG
 DEBUG = False
@@ -56,27 +53,115 @@ if force_mode:
     menu_mode = int(_settings('MenuMode'))
     view_mode = int(_settings('VideoMode'))
 
-if not xbmcvfs.exists(_addonpath):
-    xbmcvfs.mkdir(_addonpath)
-
-CACHE_FILE = xbmc.translatePath(_addonpath + 'requests_cache')
-requests_cache.install_cache(CACHE_FILE, backend='sqlite', expire_after=int(_settings('timeout')) * 3600)
+CACHE_TIMEOUT = int(_settings('timeout')) * 3600
+CACHE_FILE = xbmc.translatePath(_addonpath + 'http_cache.db')
+CACHE_SIZE = int(_settings('cache_size') or 20) * 1024 * 1024
+_http_cache = None
+RECORDS_FILE = xbmc.translatePath(_addonpath + 'records_cache.db')
+_record_cache = None
+_stream_cache = None
+# Resolved stream URLs without an Expires parameter are kept for an hour,
+# signed ones until a few minutes before they expire
+STREAM_TIMEOUT = 3600
+STREAM_MARGIN = 300
+# Parsed HLS master playlists by URL, the last VARIANTS_SIZE ones. Their
+# URLs are signed, so the resident worker would keep one per trailer played.
+VARIANTS_SIZE = 16
+_variants = collections.OrderedDict()
+# HTTP cache policy per URL class, first match wins, as (url pattern, lifetime,
+# time after that a stale copy is still served while it is refreshed).
+# Trending and recent change within the hour. Playback data and video
+# metadata hold signed URLs and are never served stale.
+# Coming soon months are revalidated as soon as their records expire,
+# see month_ttl().
+CACHE_POLICIES = [(r'operationName=(TrendingTitles|RecentVideos|TrailerCategories)', 3600, CACHE_TIMEOUT),
+                  (r'graphql', CACHE_TIMEOUT, CACHE_TIMEOUT),
+                  (r'/movies-in-theaters', CACHE_TIMEOUT, CACHE_TIMEOUT),
+                  (r'/movies-coming-soon/', CACHE_TIMEOUT, 3 * CACHE_TIMEOUT),
+                  (r'/find\?', CACHE_TIMEOUT, CACHE_TIMEOUT),
+                  (r'/_json/video/', STREAM_TIMEOUT, 0),
+                  (r'VIDEO_PLAYBACK_DATA', STREAM_TIMEOUT, 0),
+                  (r'\.m3u8', STREAM_TIMEOUT, 0)]
+# The cache warming service turns this off, it wants fresh data
+SERVE_STALE = True
+# Seconds every plugin action may spend on the network, a listing is
+# built from what arrived (or is cached) by then
+ACTION_BUDGET = int(_settings('action_budget') or 20)
+# Hand listings and stream lookups to the resident worker of the service
+USE_WORKER = _settings('use_worker') != 'false'
+# Deadline of the action per thread, the worker serves several at once
+_local = threading.local()
+_client = None
+# URLs served stale and being refreshed
+_refreshing = set()
 
-CONTENT_URL = 'https://www.imdb.com/trailers/'
-SHOWING_URL = 'https://www.imdb.com/movies-in-theaters/'
-COMING_URL = 'https://www.imdb.com/movies-coming-soon/{}-{:02}'
-ID_URL = 'https://www.imdb.com/_json/video/{}'
-DETAILS_PAGE = "https://m.imdb.com/videoplayer/{}"
+# IMDb endpoints. The hidden imdb_url and graphql_url settings point them
+# at a stand-in instead, such as benchmarks/server.py
+IMDB_URL = _settings('imdb_url').rstrip('/')
+WWW_URL = IMDB_URL or 'https://www.imdb.com'
+MOBILE_URL = IMDB_URL or 'https://m.imdb.com'
+CONTENT_URL = WWW_URL + '/trailers/'
+SHOWING_URL = WWW_URL + '/movies-in-theaters/'
+COMING_URL = WWW_URL + '/movies-coming-soon/{}-{:02}'
+ID_URL = WWW_URL + '/_json/video/{}'
+FIND_URL = WWW_URL + '/find?q={}&s=tt'
+GQL_URL = _settings('graphql_url') or 'https://graphql.prod.api.imdb.a2z.com/'
+DETAILS_PAGE = MOBILE_URL + '/videoplayer/{}'
+PLAYBACK_URL = MOBILE_URL + '/ve/data/VIDEO_PLAYBACK_DATA?key={}'
 USER_AGENT = 'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.17 (KHTML, like Gecko) Chrome/24.0.1312.57 Safari/537.17'
 quality = int(_settings("video_quality")[:-1])
+ADAPTIVE = _settings('adaptive') == 'true'
+MAX_WORKERS = 4
+MAX_ITEMS = int(_settings('max_items') or 200)
+COMING_MONTHS = int(_settings('coming_months') or 4)
+PAGE_LIMIT = min(int(_settings('page_limit') or 100), MAX_ITEMS)
+PREFETCH_STREAMS = int(_settings('prefetch_streams') or 0)
+PREWARM_ART = int(_settings('prewarm_art') or 0)
+# (view type, screen width) the artwork of listings is sized for
+_art_view = None
+TRACE = _settings('trace') == 'true'
+TRACE_PATH = xbmc.translatePath(_addonpath + 'traces')
+HEADERS = {'User-Agent': USER_AGENT,
+           'Referer': 'https://www.imdb.com/',
+           'Origin': 'https://www.imdb.com',
+           'Connection': 'keep-alive'}
+GQL_HEADERS = {'content-type': 'application/json'}
+_session = None
+_session_lock = threading.Lock()
 LOGINFO = xbmc.LOGINFO if six.PY3 else xbmc.LOGNOTICE
 
-if not xbmcvfs.exists(_addonpath + 'settings.xml'):
-    _addon.openSettings()
-
 
 class Main(object):
     def __init__(self):
+        if not xbmcvfs.exists(_addonpath + 'settings.xml'):
+            _addon.openSettings()
+
+        if TRACE:
+            tracing.start(sys.argv[2] or 'main_menu')
+        set_deadline(time.time() + ACTION_BUDGET)
+        try:
+            self.dispatch()
+        except Exception as e:
+            if not network_error(e):
+                raise
+            # nothing cached to fall back on
+            self.log('giving up: {}'.format(e))
+            msg = 'IMDb is not responding, try again later'
+            xbmcgui.Dialog().notification(_plugin, msg, _icon, 3000, False)
+            if 'action=list' in sys.argv[2] or 'action=search' in sys.argv[2]:
+                xbmcplugin.endOfDirectory(int(sys.argv[1]), False)
+            elif 'action=play' in sys.argv[2]:
+                xbmcplugin.setResolvedUrl(int(sys.argv[1]), False, xbmcgui.ListItem())
+        finally:
+            flush_client()
+            if TRACE:
+                summary = tracing.finish(TRACE_PATH)
+                if summary:
+                    self.log('trace: {}'.format(summary))
+                if _http_cache is not None:
+                    self.log('http cache: {}'.format(_http_cache.counters()))
+
+    def dispatch(self):
         if ('action=list3' in sys.argv[2]):
             self.list_contents3()
         elif ('action=list2' in sys.argv[2]):
@@ -135,7 +220,11 @@ class Main(object):
         Clear the cache database.
         """
         msg = 'Cached Data has been cleared'
-        requests_cache.get_cache().clear()
+        get_http_cache().clear()
+        get_record_cache().clear()
+        get_stream_cache().clear()
+        # drop the listings the worker holds in memory
+        worker_call('clear', lambda: None)
         xbmcgui.Dialog().notification(_plugin, msg, _icon, 3000, False)
 
     def search(self):
@@ -143,33 +232,34 @@ class Main(object):
         keyboard.setHeading('Search IMDb by Title')
         keyboard.doModal()
         if keyboard.isConfirmed():
-            search_text = urllib.parse.quote(keyboard.getText())
+            search_text = keyboard.getText().strip()
         else:
             search_text = ''
         if len(search_text) > 2:
-            url = 'https://www.imdb.com/find?q={}&s=tt'.format(search_text)
-            page_data = fetch(url).text
-            tlink = SoupStrainer('table', {'class': 'findList'})
-            soup = BeautifulSoup(page_data, "html.parser", parse_only=tlink)
-            items = soup.find_all('tr')
+            items = worker_call('search', search_titles, search_text)
+            if not items:
+                xbmcgui.Dialog().notification(_plugin, 'No Trailers available', _icon, 3000, False)
+            arts = []
             for item in items:
-                imdb_id = item.find('a').get('href').split('/')[2]
-                title = item.text.strip()
-                icon = item.find('img')['src']
-                poster = icon.split('_')[0] + 'jpg'
+                title = item['title']
                 listitem = xbmcgui.ListItem(title)
-                listitem.setArt({'thumb': poster,
-                                 'icon': icon,
-                                 'poster': poster,
-                                 'fanart': _fanart})
+                art = item_art(item['poster'], item.get('fanart'))
+                listitem.setArt(art)
+                arts.append(art)
 
-                listitem.setInfo(type='video',
-                                 infoLabels={'title': title,
-                                             'imdbnumber': imdb_id})
+                labels = {'title': title}
+                for label, field in (('imdbnumber', 'imdb'), ('year', 'year'), ('plot', 'plot')):
+                    if item.get(field):
+                        labels.update({label: item[field]})
+                listitem.setInfo(type='video', infoLabels=labels)
 
                 listitem.setProperty('IsPlayable', 'true')
-                url = sys.argv[0] + '?' + urllib.parse.urlencode({'action': 'play_id',
-                                                                  'imdb': imdb_id})
+                # Titles known from a listing come with the video to play
+                if item.get('videoId'):
+                    query = {'action': 'play', 'videoid': item['videoId']}
+                else:
+                    query = {'action': 'play_id', 'imdb': item['imdb']}
+                url = sys.argv[0] + '?' + urllib.parse.urlencode(query)
                 xbmcplugin.addDirectoryItem(int(sys.argv[1]), url, listitem, False)
 
             # Sort methods and content type...
@@ -180,6 +270,7 @@ class Main(object):
                 xbmc.executebuiltin('Container.SetViewMode({})'.format(view_mode))
             # End of directory...
             xbmcplugin.endOfDirectory(int(sys.argv[1]), cacheToDisc=True)
+            self.prewarm_art(arts)
         else:
             msg = 'Need atleast 3 characters'
             xbmcgui.Dialog().notification(_plugin, msg, _icon, 3000, False)
@@ -188,69 +279,12 @@ class Main(object):
     def list_contents2(self):
         if DEBUG:
             self.log('content_list2()')
-        if self.parameters('key') == 'showing':
-            page_data = fetch(SHOWING_URL).text
-            tlink = SoupStrainer('div', {'id': 'main'})
-        else:
-            year, month, _ = datetime.date.today().isoformat().split('-')
-            page_data = ''
-            nyear = int(year)
-            for i in range(4):
-                nmonth = int(month) + i
-                if nmonth > 12:
-                    nmonth = nmonth - 12
-                    nyear = int(year) + 1
-                url = COMING_URL.format(nyear, nmonth)
-                page_data += fetch(url).text
-            tlink = SoupStrainer('div', {'class': 'list detail'})
-
-        mdiv = BeautifulSoup(page_data, "html.parser", parse_only=tlink)
-        videos = mdiv.find_all('table')
-        h = _html_parser
-
-        for video in videos:
-            vdiv = video.find('a', {'itemprop': 'trailer'})
-            if vdiv:
-                videoId = vdiv.get('href').split('?')[0].split('/')[-1]
-                plot = h.unescape(video.find(class_='outline').text).strip()
-                tdiv = video.find(class_='image')
-                icon = tdiv.find('img')['src']
-                title = tdiv.find('img')['title']
-                # imdb = tdiv.find('a')['href'].split('/')[-2]
-                poster = icon.split('_')[0] + 'jpg'
-                infos = video.find_all(class_='txt-block')
-                director = []
-                directors = infos[0].find_all('a')
-                for name in directors:
-                    director.append(name.text)
-                cast = []
-                stars = infos[1].find_all('a')
-                for name in stars:
-                    cast.append(name.text)
-                labels = {'title': title,
-                          'plot': plot,
-                          # 'imdbnumber': imdb,
-                          'director': director,
-                          'cast': cast}
-                try:
-                    year = int(re.findall(r'\((\d{4})', title)[0])
-                    title = re.sub(r'\s\(\d{4}\)', '', title)
-                    labels.update({'title': title, 'year': year})
-                except IndexError:
-                    pass
-
-                listitem = xbmcgui.ListItem(title)
-                listitem.setArt({'thumb': poster,
-                                 'icon': icon,
-                                 'poster': poster,
-                                 'fanart': _fanart})
-
-                listitem.setInfo(type='video', infoLabels=labels)
-
-                listitem.setProperty('IsPlayable', 'true')
-                url = sys.argv[0] + '?' + urllib.parse.urlencode({'action': 'play',
-                                                                  'videoid': videoId})
-                xbmcplugin.addDirectoryItem(int(sys.argv[1]), url, listitem, False)
+        key = self.parameters('key')
+        video_ids = []
+        arts = []
+        for record in worker_call('listing', listing, key):
+            arts.append(self.add_video_item(record))
+            video_ids.append(record['videoId'])
 
         # Sort methods and content type...
         xbmcplugin.setContent(int(sys.argv[1]), 'movies')
@@ -260,91 +294,25 @@ class Main(object):
             xbmc.executebuiltin('Container.SetViewMode({})'.format(view_mode))
         # End of directory...
         xbmcplugin.endOfDirectory(int(sys.argv[1]), True)
+        self.prefetch_streams(video_ids)
+        self.prewarm_art(arts)
 
     def list_contents3(self):
         if DEBUG:
             self.log('content_list3()')
 
         key = self.parameters('key')
-        videos = fetchdata3(key)
-        for video in videos:
+        page = int(self.parameters('page', 0))
+        records, next_token = worker_call('page', cached_page, key, self.parameters('token'))
+        video_ids = []
+        arts = []
+        for record in records:
             if DEBUG:
-                self.log(repr(video))
-            if key == 'trending' or key == 'anticipated' or key == 'popular':
-                title = video.get('titleText').get('text')
-                imdb = video.get('id')
-                videoId = video.get('latestTrailer').get('id')
-                duration = video.get('latestTrailer').get('runtime').get('value')
-                name = video.get('latestTrailer').get('name').get('value')
-                plot = video.get('latestTrailer').get('description').get('value') if video.get('latestTrailer').get('description') else ''
-                if plot == name or len(plot) == 0:
-                    try:
-                        plot = video.get('plot').get('plotText').get('plainText')
-                    except AttributeError:
-                        pass
-                fanart = video.get('latestTrailer').get('thumbnail').get('url', '')
-                try:
-                    poster = video.get('primaryImage').get('url', '')
-                except AttributeError:
-                    poster = fanart
-                try:
-                    year = video.get('releaseDate').get('year')
-                except AttributeError:
-                    year = ''
-            elif key == 'recent':
-                try:
-                    title = video.get('primaryTitle').get('titleText').get('text')
-                except AttributeError:
-                    title = ''
-                try:
-                    imdb = video.get('primaryTitle').get('id')
-                except AttributeError:
-                    imdb = ''
-                videoId = video.get('id')
-                duration = video.get('runtime').get('value')
-                name = video.get('name').get('value')
-                plot = video.get('description').get('value') if video.get('description') else ''
-                if plot == name or len(plot) == 0:
-                    try:
-                        plot = video.get('primaryTitle').get('plot').get('plotText').get('plainText')
-                    except AttributeError:
-                        pass
-                fanart = video.get('thumbnail').get('url', '')
-                try:
-                    poster = video.get('primaryTitle').get('primaryImage').get('url', '')
-                except AttributeError:
-                    poster = fanart
-                try:
-                    year = video.get('primaryTitle').get('releaseDate').get('year')
-                except AttributeError:
-                    year = ''
-
-            if title in name:
-                name = name.replace(title, '').strip()
-            if len(name) > 0:
-                if six.PY2:
-                    name = name.encode('utf8')
-                    title = title.encode('utf8')
-                title = '{0} [COLOR cyan][I]{1}[/I][/COLOR]'.format(title, name)
-            labels = {'title': title,
-                      'plot': plot,
-                      'duration': duration,
-                      'imdbnumber': imdb}
-            if year:
-                labels.update({'year': year})
-
-            listitem = xbmcgui.ListItem(title)
-            listitem.setArt({'thumb': poster,
-                             'icon': poster,
-                             'poster': poster,
-                             'fanart': fanart})
-
-            listitem.setInfo(type='video', infoLabels=labels)
-
-            listitem.setProperty('IsPlayable', 'true')
-            url = sys.argv[0] + '?' + urllib.parse.urlencode({'action': 'play',
-                                                              'videoid': videoId})
-            xbmcplugin.addDirectoryItem(int(sys.argv[1]), url, listitem, False)
+                self.log(repr(record))
+            arts.append(self.add_video_item(record))
+            video_ids.append(record['videoId'])
+        if next_token and (page + 1) * PAGE_LIMIT < MAX_ITEMS:
+            self.add_next_page(key, next_token, page + 1)
 
         # Sort methods and content type...
         xbmcplugin.setContent(int(sys.argv[1]), 'movies')
@@ -354,49 +322,54 @@ class Main(object):
             xbmc.executebuiltin('Container.SetViewMode({})'.format(view_mode))
         # End of directory...
         xbmcplugin.endOfDirectory(int(sys.argv[1]), True)
+        self.prefetch_streams(video_ids)
+        self.prewarm_art(arts)
+
+    def add_next_page(self, key, token, page):
+        listitem = xbmcgui.ListItem(_language(30212))
+        listitem.setArt({'thumb': _icon,
+                         'fanart': _fanart,
+                         'icon': _icon})
+        listitem.setProperty('SpecialSort', 'bottom')
+        url = sys.argv[0] + '?' + urllib.parse.urlencode({'action': 'list3',
+                                                          'key': key,
+                                                          'token': token,
+                                                          'page': page})
+        xbmcplugin.addDirectoryItem(int(sys.argv[1]), url, listitem, True)
+
+    def add_video_item(self, record):
+        title = record['title']
+        name = record.get('name', '')
+        if title in name:
+            name = name.replace(title, '').strip()
+        if len(name) > 0:
+            if six.PY2:
+                name = name.encode('utf8')
+                title = title.encode('utf8')
+            title = '{0} [COLOR cyan][I]{1}[/I][/COLOR]'.format(title, name)
+        labels = {'title': title,
+                  'plot': record['plot']}
+        for label, field in (('year', 'year'), ('duration', 'duration'), ('imdbnumber', 'imdb'),
+                             ('director', 'director'), ('cast', 'cast')):
+            if record.get(field):
+                labels.update({label: record[field]})
+
+        listitem = xbmcgui.ListItem(title)
+        art = item_art(record['poster'], record.get('fanart'))
+        listitem.setArt(art)
+
+        listitem.setInfo(type='video', infoLabels=labels)
+
+        listitem.setProperty('IsPlayable', 'true')
+        url = sys.argv[0] + '?' + urllib.parse.urlencode({'action': 'play',
+                                                          'videoid': record['videoId']})
+        xbmcplugin.addDirectoryItem(int(sys.argv[1]), url, listitem, False)
+        return art
 
     def get_video_url(self, video_id):
         if DEBUG:
             self.log('get_video_url()')
-        data = {"type": "VIDEO_PLAYER",
-                "subType": "FORCE_LEGACY",
-                "id": video_id}
-        if six.PY3:
-            data = base64.b64encode(json.dumps(data).encode())
-            vidurl = 'https://m.imdb.com/ve/data/VIDEO_PLAYBACK_DATA?key={}'.format(data.decode())
-        else:
-            data = base64.b64encode(json.dumps(data))
-            vidurl = 'https://m.imdb.com/ve/data/VIDEO_PLAYBACK_DATA?key={}'.format(data)
-        details = fetch(vidurl).text
-        if quality == 480 or '"definition":"auto"' not in details.lower():
-            vids = re.findall(r'definition":"(\d+)p".+?url":"([^"]+)', details, re.IGNORECASE)
-            vids.sort(key=lambda x: int(x[0]), reverse=True)
-            if DEBUG:
-                self.log('Found %s videos' % len(vids))
-            for qual, vid in vids:
-                if int(qual) <= quality:
-                    if DEBUG:
-                        self.log('videoURL: %s' % vid)
-                    videoUrl = vid.replace('\\u002F', '/').replace('\\/', '/')
-                    if DEBUG:
-                        self.log('cleaned videoURL: %s' % videoUrl)
-                    return videoUrl
-        else:
-            vid = re.findall(r'definition":"auto".+?url":"([^"]+)', details, re.IGNORECASE)[0]
-            hls = fetch(vid).text
-            hlspath = re.findall(r'(http.+/)', vid)[0]
-            quals = re.findall(r'BANDWIDTH=([^,]+)[^x]+x(\d+).+\n([^\n]+)', hls)
-            if DEBUG:
-                self.log('Found %s qualities' % len(quals))
-            quals = sorted(quals, key=lambda x: int(x[0]), reverse=True)
-            if DEBUG:
-                self.log('Found %s qualities after sort' % len(quals))
-            for _, qual, svid in quals:
-                if int(qual) <= quality:
-                    videoUrl = hlspath + svid
-                    if DEBUG:
-                        self.log('videoURL: %s' % videoUrl)
-                    return videoUrl
+        return worker_call('video_url', resolve_video_url, video_id)
 
     def play(self):
         if DEBUG:
@@ -413,123 +386,848 @@ class Main(object):
                                    'plot': plot,
                                    'plotOutline': plot})
 
-        listitem.setPath(self.get_video_url(self.parameters('videoid')))
+        self.set_stream(listitem, self.get_video_url(self.parameters('videoid')))
         xbmcplugin.setResolvedUrl(int(sys.argv[1]), True, listitem=listitem)
 
+    def set_stream(self, listitem, url):
+        listitem.setPath(url)
+        if url and '.m3u8' in url and use_adaptive():
+            # master playlist, inputstream.adaptive picks and switches the variants
+            listitem.setProperty('inputstream' if six.PY3 else 'inputstreamaddon', 'inputstream.adaptive')
+            listitem.setProperty('inputstream.adaptive.manifest_type', 'hls')
+            listitem.setProperty('inputstream.adaptive.stream_selection_type', 'adaptive')
+            listitem.setProperty('inputstream.adaptive.chooser_resolution_max', '{}p'.format(quality))
+            listitem.setMimeType('application/vnd.apple.mpegurl')
+            listitem.setContentLookup(False)
+
     def play_id(self):
         if DEBUG:
             self.log('play_id()')
-        iurl = ID_URL.format(self.parameters('imdb'))
-        if DEBUG:
-            self.log('IMDBURL: %s' % iurl)
-        try:
-            details = fetch(iurl).json()
-        except ValueError:
+        imdb = self.parameters('imdb')
+        videoUrl = worker_call('title_url', resolve_title_url, imdb)
+        if not videoUrl:
             msg = 'No Trailers available'
             xbmcgui.Dialog().notification(_plugin, msg, _icon, 3000, False)
-        video_list = details['playlists'][self.parameters('imdb')]['listItems']
-        if len(video_list) > 0:
-            videoid = video_list[0]['videoId']
+            return
+
+        title = xbmc.getInfoLabel("ListItem.Title")
+        thumbnail = xbmc.getInfoImage("ListItem.Thumb")
+        listitem = xbmcgui.ListItem(title)
+        listitem.setArt({'thumb': thumbnail})
+        # set the key information
+        listitem.setInfo('video', {'title': title})
+
+        listitem.setPath(videoUrl)
+        xbmcplugin.setResolvedUrl(int(sys.argv[1]), True, listitem=listitem)
+
+    def prefetch_streams(self, video_ids):
+        """
+        Resolve the playback URLs of the first items of a listing in the
+        background once the directory is shown, so play starts instantly.
+        """
+        def resolve(video_id):
+            try:
+                worker_call('video_url', resolve_video_url, video_id)
+            except Exception as e:
+                if DEBUG:
+                    self.log('prefetch of %s failed: %s' % (video_id, e))
+
+        for _ in threaded_map(resolve, video_ids[:PREFETCH_STREAMS]):
+            pass
+
+    def prewarm_art(self, arts):
+        """
+        Load the artwork of the first items of a listing into Kodi's texture
+        cache in the background once the directory is shown, so it is there
+        when the user scrolls. Kodi only caches what is requested from it,
+        so this goes through its web server and is skipped when that is off.
+        """
+        if not PREWARM_ART:
+            return
+        server = texture_server()
+        if server is None:
             if DEBUG:
-                self.log('VideoID: %s' % videoid)
-            title = xbmc.getInfoLabel("ListItem.Title")
-            thumbnail = xbmc.getInfoImage("ListItem.Thumb")
-            listitem = xbmcgui.ListItem(title)
-            listitem.setArt({'thumb': thumbnail})
-            # set the key information
-            listitem.setInfo('video', {'title': title})
-
-            encodings = details['videoMetadata'][videoid]['encodings']
-            vids = []
-            for item in encodings:
-                if item['mimeType'] == 'video/mp4':
-                    qual = "360p" if item["definition"] == "SD" else item["definition"]
-                    vids.append((qual[:-1], item["videoUrl"]))
-            vids.sort(key=lambda elem: int(elem[0]), reverse=True)
-            for qual, vid in vids:
-                if int(qual) <= quality:
-                    if DEBUG:
-                        self.log('videoURL: %s' % vid)
-                    videoUrl = vid
-                    break
-
-            listitem.setPath(videoUrl)
-            xbmcplugin.setResolvedUrl(int(sys.argv[1]), True, listitem=listitem)
-        else:
-            msg = 'No Trailers available'
-            xbmcgui.Dialog().notification(_plugin, msg, _icon, 3000, False)
+                self.log('web server off, artwork not pre-cached')
+            return
+        base, auth = server
+        urls = []
+        for art in arts[:PREWARM_ART]:
+            for slot in ('poster', 'fanart'):
+                url = art.get(slot)
+                if url and url.startswith('http') and url not in urls:
+                    urls.append(url)
 
-    def parameters(self, arg):
+        def load(url):
+            try:
+                get_session().get(artwork.texture_url(base, url), auth=auth, timeout=30)
+            except Exception as e:
+                if DEBUG:
+                    self.log('pre-caching %s failed: %s' % (url, e))
+
+        with tracing.span('artwork', items=len(urls)):
+            for _ in threaded_map(load, urls):
+                pass
+
+    def parameters(self, arg, default=None):
         _parameters = urllib.parse.parse_qs(urllib.parse.urlparse(sys.argv[2]).query)
-        return _parameters[arg][0]
+        return _parameters[arg][0] if arg in _parameters else default
 
     def log(self, description):
-        xbmc.log("[ADD-ON] '{} v{}': {}".format(_plugin, _version, description), LOGINFO)
+        log(description)
+
+
+def log(description):
+    xbmc.log("[ADD-ON] '{} v{}': {}".format(_plugin, _version, description), LOGINFO)
+
+
+def get_session():
+    """
+    Shared keep-alive session, so every request to the same host reuses
+    a pooled connection instead of paying a fresh TCP+TLS handshake.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4,
+                                                    pool_maxsize=MAX_WORKERS)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update(HEADERS)
+            session.headers.update({'Accept-Encoding': accept_encoding()})
+            _session = session
+    return _session
+
+
+def accept_encoding():
+    # Only advertise brotli when urllib3 is able to decode it
+    try:
+        import brotli  # noqa: F401
+        return 'gzip, deflate, br'
+    except ImportError:
+        return 'gzip, deflate'
+
+
+def get_client():
+    """
+    Shared network.Client sending the requests of get_session(), with its
+    per host latency and circuit state kept in the HTTP cache database.
+    """
+    global _client
+    if _client is None:
+        from resources.lib import network
+        _client = network.Client(get_session(), get_http_cache())
+    return _client
+
+
+def flush_client():
+    # keep the latencies seen by this action for the next ones
+    if _client is not None:
+        _client.flush()
+
+
+def worker_call(op, func, *args):
+    """
+    Return func(*args), computed by the resident worker of the service
+    when it runs (op names it there, see worker.OPS), else in this process.
+    A trace needs the fetch/parse/cache steps in this process, so the
+    worker is skipped while tracing.
+    """
+    if USE_WORKER and not TRACE:
+        from resources.lib import worker
+        try:
+            with tracing.span('worker', op=op):
+                return worker.call(op, args, get_deadline())
+        except worker.Unavailable as e:
+            if DEBUG:
+                log('worker {}: {}'.format(op, e))
+    return func(*args)
+
+
+def set_deadline(deadline):
+    """
+    Make the requests of this thread from now on end by deadline (a
+    time.time() value), None for no limit.
+    """
+    _local.deadline = deadline
+
+
+def get_deadline():
+    return getattr(_local, 'deadline', None)
+
+
+def under_deadline(func):
+    """
+    Wrap func to run under the deadline of the calling thread in the thread it is handed to.
+    """
+    deadline = get_deadline()
+
+    def run(*args):
+        set_deadline(deadline)
+        return func(*args)
+    return run
+
+
+def network_error(e):
+    import requests
+    from resources.lib import network
+    return isinstance(e, (requests.RequestException, network.NetworkError))
+
+
+def get_http_cache():
+    """
+    Open the HTTP cache on first use, the database left by requests_cache is removed.
+    """
+    global _http_cache
+    if _http_cache is None:
+        from resources.lib.cache import HttpCache
+        make_profile()
+        if xbmcvfs.exists(_addonpath + 'requests_cache.sqlite'):
+            xbmcvfs.delete(_addonpath + 'requests_cache.sqlite')
+        _http_cache = HttpCache(CACHE_FILE, CACHE_SIZE)
+    return _http_cache
+
+
+def cache_policy(url):
+    """
+    Return (lifetime, stale time) of the HTTP cache entry of url.
+    """
+    for pattern, lifetime, stale in CACHE_POLICIES:
+        if re.search(pattern, url):
+            return lifetime, stale
+    return CACHE_TIMEOUT, 0
+
+
+def records_ttl(key):
+    """
+    Lifetime of the records of a category, the one of the responses they are parsed from.
+    """
+    if key in GQL_CATEGORIES:
+        return cache_policy('{}?operationName={}'.format(GQL_URL, GQL_CATEGORIES[key][0]))[0]
+    return cache_policy(SHOWING_URL)[0]
+
+
+def month_ttl(distance):
+    """
+    Lifetime of the records of a coming soon month, distance months from
+    now. Next month's releases still move around, the far ones rarely do.
+    """
+    return CACHE_TIMEOUT * (distance + 1)
+
+
+def item_art(poster, fanart=None):
+    """
+    Art of a listing item, the IMDb images sized for the view the listing
+    is shown in (the forced one, else the current one) and the screen.
+    """
+    global _art_view
+    if _art_view is None:
+        if force_mode:
+            view = artwork.view_type(view_mode)
+        else:
+            view = artwork.view_type(label=xbmc.getInfoLabel('Container.Viewmode'))
+        try:
+            width = int(xbmc.getInfoLabel('System.ScreenWidth'))
+        except ValueError:
+            width = 0
+        _art_view = (view, width)
+    art = artwork.art(poster, fanart, *_art_view)
+    if not art['fanart']:
+        art['fanart'] = _fanart
+    return art
+
+
+def texture_server():
+    """
+    Return (base URL, auth) of Kodi's web server, or None when it is off.
+    """
+    values = {}
+    for setting in ('webserver', 'webserverport', 'webserverusername', 'webserverpassword'):
+        request = {'jsonrpc': '2.0', 'id': 1, 'method': 'Settings.GetSettingValue',
+                   'params': {'setting': 'services.' + setting}}
+        response = json.loads(xbmc.executeJSONRPC(json.dumps(request)))
+        values[setting] = response.get('result', {}).get('value')
+    if not values['webserver']:
+        return None
+    auth = (values['webserverusername'], values['webserverpassword'] or '') if values['webserverusername'] else None
+    return 'http://127.0.0.1:{}'.format(values['webserverport'] or 8080), auth
+
+
+def make_profile():
+    if not xbmcvfs.exists(_addonpath):
+        xbmcvfs.mkdir(_addonpath)
 
 
 def fetch(url):
-    headers = {'User-Agent': USER_AGENT,
-               'Referer': 'https://www.imdb.com/',
-               'Origin': 'https://www.imdb.com'}
-    if 'graphql' in url:
-        headers.update({'content-type': 'application/json'})
-    data = requests.get(url, headers=headers)
+    """
+    GET url through the HTTP cache. A fresh entry is returned as it is, a
+    stale one is returned at once while a background thread refreshes it,
+    anything else is downloaded (or revalidated) and stored. When the
+    download fails or the server errors, the cached entry is served
+    however old it is, and without one a server error raises NetworkError.
+    Every response has a digest of its body, see RecordCache.reuse().
+    """
+    with tracing.span('fetch', url=url) as span:
+        now = time.time()
+        entry = get_http_cache().get(url)
+        if entry is not None and (entry.expires > now or (SERVE_STALE and entry.keep_until > now)):
+            data = cached_response(url, entry)
+            if entry.expires <= now:
+                data.stale = True
+                refresh_later(url, entry)
+        else:
+            try:
+                data = download(url, entry)
+            except Exception as e:
+                if entry is None or not network_error(e):
+                    raise
+                data = stale_response(url, entry, e)
+            if data.status_code >= 500 or data.status_code == 429:
+                if entry is None:
+                    from resources.lib import network
+                    raise network.NetworkError('HTTP {} from {}'.format(data.status_code, url))
+                data = stale_response(url, entry, 'HTTP {}'.format(data.status_code))
+        if span:
+            span.set(status=data.status_code, bytes=data.length, cache=data.from_cache, stale=data.stale,
+                     saved=data.saved, attempts=getattr(data, 'attempts', 0))
     return data
 
 
-def fetchdata3(key):
-    api_url = 'https://graphql.prod.api.imdb.a2z.com/'
-    vpar = {'limit': 100}
-    if key == 'trending':
-        query_pt1 = ("query TrendingTitles($limit: Int!, $paginationToken: String) {"
-                     "  trendingTitles(limit: $limit, paginationToken: $paginationToken) {"
-                     "    titles {"
-                     "      latestTrailer {"
-                     "        ...TrailerVideoMeta"
-                     "      }"
-                     "      ...TrailerTitleMeta"
-                     "    }"
-                     "    paginationToken"
-                     "  }"
-                     "}")
-        ptoken = "60"
-        opname = "TrendingTitles"
-    elif key == 'recent':
-        query_pt1 = ("query RecentVideos($limit: Int!, $paginationToken: String, $queryFilter: RecentVideosQueryFilter!) {"
-                     "  recentVideos(limit: $limit, paginationToken: $paginationToken, queryFilter: $queryFilter) {"
-                     "    videos {"
-                     "      ...TrailerVideoMeta"
-                     "      primaryTitle {"
-                     "        ...TrailerTitleMeta"
-                     "      }"
-                     "    }"
-                     "    paginationToken"
-                     "  }"
-                     "}")
-        ptoken = "blank"
-        opname = "RecentVideos"
-        vpar.update({'queryFilter': {"contentTypes": ["TRAILER"]}})
-    elif key == 'anticipated' or key == 'popular':
-        query_pt1 = ("query PopularTitles($limit: Int!, $paginationToken: String, $queryFilter: PopularTitlesQueryFilter!) {"
-                     "  popularTitles(limit: $limit, paginationToken: $paginationToken, queryFilter: $queryFilter) {"
-                     "    titles {"
-                     "      latestTrailer {"
-                     "        ...TrailerVideoMeta"
-                     "      }"
-                     "      ...TrailerTitleMeta"
-                     "    }"
-                     "    paginationToken"
-                     "  }"
-                     "}")
-        ptoken = "blank"
-        opname = "PopularTitles"
-        d1 = datetime.date.today().isoformat()
-        if key == 'anticipated':
-            vpar.update({'queryFilter': {"releaseDateRange": {"start": d1}}})
-        else:
-            vpar.update({'queryFilter': {"releaseDateRange": {"end": d1}}})
+def download(url, entry=None):
+    """
+    GET url and store the response. When an expired entry has validators
+    it is revalidated, a 304 renews the entry instead of downloading the body.
+    """
+    headers = dict(GQL_HEADERS) if 'graphql' in url else {}
+    if entry is not None:
+        validators = dict((name.lower(), value) for name, value in entry.headers.items())
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'last-modified' in validators:
+            headers['If-Modified-Since'] = validators['last-modified']
+    data = get_client().get(url, headers=headers, deadline=get_deadline())
+    lifetime, stale = cache_policy(url)
+    now = time.time()
+    if data.status_code == 304 and entry is not None:
+        get_http_cache().renew(url, now + lifetime, now + lifetime + stale)
+        get_http_cache().count(revalidated=1, bytes_saved=entry.length)
+        data = cached_response(url, entry)
+        data.saved = entry.length
+        return data
+    data.from_cache = data.stale = False
+    data.saved = 0
+    data.length = len(data.content)
+    data.digest = hashlib.sha1(data.content).hexdigest()
+    if data.status_code == 200 and lifetime:
+        get_http_cache().set(url, data.status_code, data.encoding, dict(data.headers), data.content,
+                             now + lifetime, now + lifetime + stale, data.digest)
+    return data
+
+
+def cached_response(url, entry):
+    import requests
+    from resources.lib.cache import BodyReader
+    data = requests.models.Response()
+    data.url = url
+    data.status_code = entry.status
+    data.encoding = entry.encoding
+    data.headers = requests.structures.CaseInsensitiveDict(entry.headers)
+    # the body is decompressed when data.content is first read
+    data.raw = BodyReader(entry)
+    data.length = entry.length
+    data.digest = entry.digest
+    data.from_cache = True
+    data.stale = False
+    data.saved = 0
+    return data
+
+
+def stale_response(url, entry, error):
+    log('serving cached {} after: {}'.format(url, error))
+    get_http_cache().count(stale_on_error=1)
+    data = cached_response(url, entry)
+    data.stale = True
+    return data
+
+
+def refresh_later(url, entry):
+    """
+    Revalidate (or download) url with its stale entry on a background
+    thread, once at a time per URL.
+    Records parsed from the stale copy are not stored in the record cache
+    (see response.stale), so the next visit picks up the refreshed response.
+    """
+    with _session_lock:
+        if url in _refreshing:
+            return
+        _refreshing.add(url)
+
+    def refresh():
+        try:
+            download(url, entry)
+        except Exception as e:
+            log('refreshing {} failed: {}'.format(url, e))
+        finally:
+            with _session_lock:
+                _refreshing.discard(url)
+
+    threading.Thread(target=under_deadline(refresh)).start()
+
+
+def listing(key):
+    """
+    Iterable of the records of the In Theaters or Coming Soon listing.
+    """
+    if key == 'coming':
+        # every month is cached on its own, see fetch_month()
+        return (record for page in fetchdata2(key) for record in page)
+    return cached_records(key, fetchdata2(key))
+
+
+def cached_records(key, pages):
+    """
+    Yield the normalized records of a listing from the record cache, or
+    from pages (a lazy iterable of record lists storing themselves, see
+    fetch_showing()).
+    """
+    with tracing.span('records', key=key) as span:
+        records = get_record_cache().get(key)
+        if span:
+            span.set(cache=records is not None, items=len(records or []))
+    if records is not None:
+        for record in records:
+            yield record
+        return
+
+    for page in pages:
+        for record in page:
+            yield record
+
+
+def refresh_records(key, first=None):
+    """
+    Fetch, parse and store the records of a category, used by the cache warming service.
+    first is the prefetched first page of a GraphQL category, see fetch_first_pages().
+    """
+    if key in ('showing', 'coming'):
+        # fetch_showing() and fetch_month() store the records, for coming
+        # soon only the expired months are fetched
+        for _ in fetchdata2(key):
+            pass
+    else:
+        # fetchdata3 stores every page on its own
+        for _ in fetchdata3(key, first=first):
+            pass
+
+
+def records_expired(key):
+    """
+    Whether the records of a category are missing or expired, for coming
+    soon whether any month of the window is.
+    """
+    cache = get_record_cache()
+    if key == 'coming':
+        return any(cache.expired(month[0]) for month in coming_months())
+    return cache.expired(records_key(key))
+
+
+def records_key(key):
+    """
+    Record cache key of a category, for GraphQL categories the one of their first page.
+    """
+    if key in GQL_CATEGORIES:
+        return page_key(key, GQL_CATEGORIES[key][3])
+    return key
+
+
+def get_record_cache():
+    global _record_cache
+    if _record_cache is None:
+        from resources.lib.cache import RecordCache
+        make_profile()
+        _record_cache = RecordCache(RECORDS_FILE, CACHE_TIMEOUT)
+    return _record_cache
+
+
+def threaded_map(func, items, workers=MAX_WORKERS):
+    """
+    Apply func to every item on a bounded pool of threads.
+    Results are yielded in input order, each one as soon as it is ready.
+    """
+    func = under_deadline(func)
+    items = list(items)
+    results = [None] * len(items)
+    done = [threading.Event() for _ in items]
+    pending = list(range(len(items)))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                idx = pending.pop(0)
+            try:
+                results[idx] = (True, func(items[idx]))
+            except Exception as e:
+                results[idx] = (False, e)
+            done[idx].set()
+
+    for _ in range(min(workers, len(items))):
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+
+    for idx in range(len(items)):
+        done[idx].wait()
+        ok, result = results[idx]
+        results[idx] = None
+        if not ok:
+            raise result
+        yield result
+
+
+def coming_months(months=None):
+    """
+    Yield (record key, URL, months from now) of every month of the coming
+    soon window. Keys name the calendar month, so rolling into a new month
+    leaves the ones already cached valid.
+    """
+    today = datetime.date.today()
+    for i in range(COMING_MONTHS if months is None else months):
+        nmonth = today.month + i
+        nyear = today.year + (nmonth - 1) // 12
+        nmonth = (nmonth - 1) % 12 + 1
+        yield 'coming:{}-{:02}'.format(nyear, nmonth), COMING_URL.format(nyear, nmonth), i
+
+
+def fetch_showing():
+    """
+    Fetch, parse and cache the records of In Theaters.
+    """
+    with tracing.span('page', key='showing') as span:
+        response = fetch(SHOWING_URL)
+        # records of a stale copy are served but not stored or renewed
+        ttl = None if response.stale else records_ttl('showing')
+        # A byte-identical page gives the records stored last time
+        page = get_record_cache().reuse('showing', response.digest, ttl)
+        if page is not None:
+            get_http_cache().count(parses_skipped=1)
+            if span:
+                span.set(items=len(page[0]), reused=True)
+            return page[0]
+        records = parsers.parse_titles(response.text, parsers.MAIN_BLOCK)
+        if span:
+            span.set(items=len(records))
+    if not response.stale:
+        get_record_cache().set('showing', records, expire_after=ttl, digest=response.digest)
+    return records
+
+
+def fetch_month(month):
+    """
+    Fetch, parse and cache the records of one coming soon month.
+    """
+    key, url, distance = month
+    with tracing.span('month', key=key) as span:
+        response = fetch(url)
+        ttl = None if response.stale else month_ttl(distance)
+        # A byte-identical page gives the records stored last time
+        page = get_record_cache().reuse(key, response.digest, ttl)
+        if page is not None:
+            get_http_cache().count(parses_skipped=1)
+            if span:
+                span.set(items=len(page[0]), reused=True)
+            return page[0]
+        records = parsers.parse_titles(response.text, parsers.LIST_BLOCK)
+        if span:
+            span.set(items=len(records))
+    if not response.stale:
+        get_record_cache().set(key, records, expire_after=ttl, digest=response.digest)
+    return records
+
+
+def try_fetch_month(month):
+    # A month that cannot be had leaves a gap instead of failing the listing
+    try:
+        return fetch_month(month)
+    except Exception as e:
+        if not network_error(e):
+            raise
+        log('skipping {}: {}'.format(month[0], e))
+        return []
+
+
+def fetchdata2(key):
+    if key == 'showing':
+        yield fetch_showing()
+    else:
+        months = list(coming_months())
+        with tracing.span('records', key=key) as span:
+            cache = get_record_cache()
+            pages = [cache.get(month[0]) for month in months]
+            if span:
+                span.set(cache=None not in pages, items=sum(len(page or []) for page in pages))
+        # The missing months are fetched and parsed on the worker pool,
+        # results come back in month order as soon as they are ready
+        missing = threaded_map(try_fetch_month, [month for month, page in zip(months, pages) if page is None])
+        for page in pages:
+            yield page if page is not None else next(missing)
+
+
+def resolve_video_url(video_id):
+    adaptive = use_adaptive()
+    # master playlists for inputstream.adaptive are cached apart from the
+    # URLs of a fixed quality, under quality 0
+    stream_quality = 0 if adaptive else quality
+    with tracing.span('resolve', videoId=video_id) as span:
+        cache = get_stream_cache()
+        videoUrl = cache.get(video_id, stream_quality)
+        if span:
+            span.set(cache=videoUrl is not None)
+        if videoUrl is None:
+            videoUrl = fetch_video_url(video_id, adaptive)
+            if videoUrl:
+                cache.set(video_id, stream_quality, videoUrl, url_expiry(videoUrl))
+    return videoUrl
+
+
+def resolve_title_url(imdb):
+    """
+    Playback URL of the latest trailer of an IMDb title, or None when it
+    has none, kept in the stream cache like resolve_video_url().
+    """
+    with tracing.span('resolve', imdb=imdb) as span:
+        cache = get_stream_cache()
+        videoUrl = cache.get(imdb, quality)
+        if span:
+            span.set(cache=videoUrl is not None)
+        if videoUrl is None:
+            videoUrl = fetch_title_url(imdb)
+            if videoUrl:
+                cache.set(imdb, quality, videoUrl, url_expiry(videoUrl))
+    return videoUrl
+
+
+def fetch_title_url(imdb):
+    iurl = ID_URL.format(imdb)
+    if DEBUG:
+        log('IMDBURL: %s' % iurl)
+    try:
+        details = fetch(iurl).json()
+        video_list = details['playlists'][imdb]['listItems']
+    except (ValueError, KeyError, TypeError):
+        return None
+    if len(video_list) == 0:
+        return None
+    videoid = video_list[0]['videoId']
+    if DEBUG:
+        log('VideoID: %s' % videoid)
+
+    encodings = details['videoMetadata'][videoid]['encodings']
+    vids = []
+    for item in encodings:
+        if item['mimeType'] == 'video/mp4':
+            qual = "360p" if item["definition"] == "SD" else item["definition"]
+            vids.append((qual[:-1], item["videoUrl"]))
+    vids.sort(key=lambda elem: int(elem[0]), reverse=True)
+    for qual, vid in vids:
+        if int(qual) <= quality:
+            if DEBUG:
+                log('videoURL: %s' % vid)
+            return vid
 
-    query_pt2 = ("fragment TrailerTitleMeta on Title {"
+
+def search_titles(query):
+    """
+    Titles matching query that have a trailer. The titles of every listing
+    seen before are indexed (see RecordCache.search()), those come first.
+    When one of them is the whole query they are the answer, else IMDb's
+    search adds its results, and when it cannot be reached the local
+    matches are the answer. When nothing matches at all, the indexed
+    titles closest to the query are, in case it has a typo.
+    """
+    with tracing.span('index', query=query) as span:
+        local, whole = get_record_cache().search(query)
+        if span:
+            span.set(items=len(local), whole=whole)
+    if whole:
+        return local
+    try:
+        remote = find_titles(FIND_URL.format(urllib.parse.quote(query.encode('utf-8') if six.PY2 else query)))
+    except Exception as e:
+        if not network_error(e):
+            raise
+        local = local or similar_titles(query)
+        if not local:
+            raise
+        log('searching IMDb failed, {} local matches: {}'.format(len(local), e))
+        return local
+    known = set(item.get('imdb') for item in local)
+    titles = set((item['title'].lower(), item.get('year')) for item in local)
+    results = local + [item for item in remote
+                       if item['imdb'] not in known and (item['title'].lower(), item.get('year')) not in titles]
+    return results or similar_titles(query)
+
+
+def similar_titles(query):
+    with tracing.span('index', query=query, similar=True) as span:
+        titles = get_record_cache().similar(query)
+        if span:
+            span.set(items=len(titles))
+    return titles
+
+
+def find_titles(url):
+    """
+    Results of an IMDb title search that have a trailer, cached per query.
+    The titles are checked on the worker pool, which leaves their playback
+    URLs in the stream cache so playing one starts at once. Titles whose
+    check failed are kept, and the results are then not cached, so the
+    next search checks them again.
+    """
+    key = 'search:' + url
+    with tracing.span('records', key=key) as span:
+        records = get_record_cache().get(key)
+        if span:
+            span.set(cache=records is not None, items=len(records or []))
+    if records is None:
+        items = parsers.parse_search(fetch(url).text)
+        found = list(threaded_map(has_trailer, [item['imdb'] for item in items]))
+        records = [item for item, ok in zip(items, found) if ok is not False]
+        if None not in found:
+            get_record_cache().set(key, records, expire_after=cache_policy(url)[0])
+    return records
+
+
+def has_trailer(imdb):
+    """
+    Whether an IMDb title has a trailer, None when the network kept that from being checked.
+    """
+    try:
+        return resolve_title_url(imdb) is not None
+    except Exception as e:
+        log('trailer check failed for {}: {}'.format(imdb, e))
+        return None if network_error(e) else False
+
+
+def use_adaptive():
+    """
+    Whether HLS master playlists are handed to inputstream.adaptive
+    instead of picking one variant here.
+    """
+    return ADAPTIVE and xbmc.getCondVisibility('System.HasAddon(inputstream.adaptive)')
+
+
+def fetch_video_url(video_id, adaptive=False):
+    data = {"type": "VIDEO_PLAYER",
+            "subType": "FORCE_LEGACY",
+            "id": video_id}
+    if six.PY3:
+        data = base64.b64encode(json.dumps(data).encode())
+        vidurl = PLAYBACK_URL.format(data.decode())
+    else:
+        data = base64.b64encode(json.dumps(data))
+        vidurl = PLAYBACK_URL.format(data)
+    details = fetch(vidurl).text
+    if (quality == 480 and not adaptive) or '"definition":"auto"' not in details.lower():
+        vids = re.findall(r'definition":"(\d+)p".+?url":"([^"]+)', details, re.IGNORECASE)
+        vids.sort(key=lambda x: int(x[0]), reverse=True)
+        if DEBUG:
+            log('Found %s videos' % len(vids))
+        for qual, vid in vids:
+            if int(qual) <= quality:
+                if DEBUG:
+                    log('videoURL: %s' % vid)
+                videoUrl = vid.replace('\\u002F', '/').replace('\\/', '/')
+                if DEBUG:
+                    log('cleaned videoURL: %s' % videoUrl)
+                return videoUrl
+    else:
+        vid = re.findall(r'definition":"auto".+?url":"([^"]+)', details, re.IGNORECASE)[0]
+        vid = vid.replace('\\u002F', '/').replace('\\/', '/')
+        if adaptive:
+            if DEBUG:
+                log('master playlist: %s' % vid)
+            return vid
+        variants = master_variants(vid)
+        if DEBUG:
+            log('Found %s qualities' % len(variants))
+        variant = hls.select(variants, quality)
+        if variant:
+            if DEBUG:
+                log('videoURL: %s' % variant.uri)
+            return variant.uri
+
+
+def master_variants(url):
+    """
+    Variants of an HLS master playlist, parsed once while it is among the
+    last VARIANTS_SIZE ones.
+    """
+    with _session_lock:
+        variants = _variants.pop(url, None)
+    if variants is None:
+        variants = hls.parse_master(fetch(url).text, url)
+    with _session_lock:
+        _variants[url] = variants
+        while len(_variants) > VARIANTS_SIZE:
+            _variants.popitem(last=False)
+    return variants
+
+
+def url_expiry(url):
+    """
+    Time until which a signed playback URL can be reused, taken from its
+    Expires parameter with a safety margin.
+    """
+    params = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    for name in ('Expires', 'expires'):
+        if name in params:
+            return int(params[name][0]) - STREAM_MARGIN
+    return time.time() + STREAM_TIMEOUT
+
+
+def compact_caches():
+    """
+    Compact the cache databases once enough of them is unused space, run by the service.
+    """
+    for cache in (get_http_cache(), get_record_cache()):
+        if cache.compact():
+            log('compacted {}'.format(cache.path))
+
+
+def get_stream_cache():
+    global _stream_cache
+    if _stream_cache is None:
+        from resources.lib.cache import StreamCache
+        make_profile()
+        _stream_cache = StreamCache(RECORDS_FILE)
+    return _stream_cache
+
+
+# GraphQL categories as (operation, field, query filter type, first pagination token)
+GQL_CATEGORIES = {'trending': ('TrendingTitles', 'trendingTitles', None, '60'),
+                  'anticipated': ('PopularTitles', 'popularTitles', 'PopularTitlesQueryFilter', 'blank'),
+                  'popular': ('PopularTitles', 'popularTitles', 'PopularTitlesQueryFilter', 'blank'),
+                  'recent': ('RecentVideos', 'recentVideos', 'RecentVideosQueryFilter', 'blank')}
+# Operation name of a request batching several categories
+GQL_BATCH = 'TrailerCategories'
+
+GQL_TITLES = ("titles {"
+              "      latestTrailer {"
+              "        ...TrailerVideoMeta"
+              "      }"
+              "      ...TrailerTitleMeta"
+              "    }")
+GQL_VIDEOS = ("videos {"
+              "      ...TrailerVideoMeta"
+              "      primaryTitle {"
+              "        ...TrailerTitleMeta"
+              "      }"
+              "    }")
+GQL_FRAGMENTS = ("fragment TrailerTitleMeta on Title {"
                  "  id"
                  "  titleText {"
                  "    text"
@@ -561,35 +1259,170 @@ def fetchdata3(key):
                  "    url"
                  "  }"
                  "}")
+# Quoted query text per tuple of keys, built once
+_gql_queries = {}
+
+
+def gql_query(keys):
+    """
+    Return (operation name, quoted query text) fetching one page of each
+    category in keys. A single category keeps its own operation, several
+    are batched into one operation with every field aliased by its key and
+    the variables suffixed with it.
+    """
+    keys = tuple(keys)
+    if keys not in _gql_queries:
+        params = []
+        fields = []
+        for key in keys:
+            _, field, filter_type, _ = GQL_CATEGORIES[key]
+            suffix = gql_suffix(keys, key)
+            params += ['$limit{}: Int!'.format(suffix), '$paginationToken{}: String'.format(suffix)]
+            args = ['limit: $limit{}'.format(suffix), 'paginationToken: $paginationToken{}'.format(suffix)]
+            if filter_type:
+                params.append('$queryFilter{}: {}!'.format(suffix, filter_type))
+                args.append('queryFilter: $queryFilter{}'.format(suffix))
+            alias = key + ': ' if len(keys) > 1 else ''
+            fields.append('  {}{}({}) {{    {}    paginationToken  }}'.format(
+                alias, field, ', '.join(args), GQL_VIDEOS if key == 'recent' else GQL_TITLES))
+        opname = GQL_CATEGORIES[keys[0]][0] if len(keys) == 1 else GQL_BATCH
+        query = 'query {}({}) {{{}}}'.format(opname, ', '.join(params), ''.join(fields)) + GQL_FRAGMENTS
+        _gql_queries[keys] = (opname, urllib.parse.quote(query, "("))
+    return _gql_queries[keys]
+
+
+def gql_suffix(keys, key):
+    return '_' + key if len(keys) > 1 else ''
+
 
-    qstr = urllib.parse.quote(query_pt1 + query_pt2, "(")
-    items = []
+def gql_filter(key):
+    if key == 'recent':
+        return {"contentTypes": ["TRAILER"]}
+    d1 = datetime.date.today().isoformat()
+    if key == 'anticipated':
+        return {"releaseDateRange": {"start": d1}}
+    return {"releaseDateRange": {"end": d1}}
 
-    while len(items) < 200 and ptoken:
+
+def gql_url(pages, limit):
+    keys = tuple(key for key, _ in pages)
+    opname, qstr = gql_query(keys)
+    vpar = {}
+    for key, ptoken in pages:
+        suffix = gql_suffix(keys, key)
+        vpar['limit' + suffix] = limit
+        if GQL_CATEGORIES[key][2]:
+            vpar['queryFilter' + suffix] = gql_filter(key)
         if ptoken != "blank":
-            vpar.update({"paginationToken": ptoken})
-
-        vtxt = urllib.parse.quote(json.dumps(vpar).replace(" ", ""))
-        r = fetch("{0}?operationName={1}&query={2}&variables={3}".format(api_url, opname, qstr, vtxt))
-        data = r.json().get('data')
-
-        if key == 'trending' or key == 'anticipated' or key == 'popular':
-            if key == 'trending':
-                data = data.get('trendingTitles')
-            elif key == 'anticipated' or key == 'popular':
-                data = data.get('popularTitles')
-            titles = data.get('titles')
-            for title in titles:
-                if title.get('latestTrailer'):
-                    items.append(title)
-        elif key == 'recent':
-            data = data.get('recentVideos')
-            titles = data.get('videos')
-            items.extend(titles)
-
-        if len(titles) < 1:
-            ptoken = None
-        else:
-            ptoken = data.get('paginationToken')
+            vpar['paginationToken' + suffix] = ptoken
+    vtxt = urllib.parse.quote(json.dumps(vpar).replace(" ", ""))
+    return "{0}?operationName={1}&query={2}&variables={3}".format(GQL_URL, opname, qstr, vtxt)
+
+
+def gql_split(keys, response):
+    """
+    Return the page data of each category of a GraphQL response as {key: data}.
+    """
+    data = response.json().get('data') or {}
+    if len(keys) == 1:
+        return {keys[0]: data.get(GQL_CATEGORIES[keys[0]][1])}
+    return dict((key, data.get(key)) for key in keys)
+
+
+def gql_items(key, data):
+    """
+    Return (records, next pagination token) of one page of a category.
+    """
+    titles = data.get('videos' if key == 'recent' else 'titles')
+    ptoken = data.get('paginationToken') if titles else None
+    return parsers.parse_graphql(key, titles or []), ptoken
 
-    return items
+
+def fetch_first_pages(keys):
+    """
+    First page of several GraphQL categories in one round-trip, as {key: page data}
+    to be handed to fetchdata3(key, first=...). Categories the response has no
+    data for are left out, all of them when it is a stale copy, whose pages
+    are not to be stored.
+    """
+    with tracing.span('batch', keys=','.join(keys)):
+        response = fetch(gql_url([(key, GQL_CATEGORIES[key][3]) for key in keys], PAGE_LIMIT))
+        if response.stale:
+            return {}
+        pages = gql_split(tuple(keys), response)
+    return dict((key, data) for key, data in pages.items() if data)
+
+
+def page_key(key, token):
+    return '{}:{}:{}'.format(key, PAGE_LIMIT, token)
+
+
+def cached_page(key, token=None):
+    """
+    Return (records, next pagination token) of one page of a GraphQL
+    category from the record cache, or fetch it. token None is the first page.
+    """
+    if token is None:
+        token = GQL_CATEGORIES[key][3]
+    with tracing.span('records', key=key, token=token) as span:
+        page = get_record_cache().get_page(page_key(key, token))
+        if span:
+            span.set(cache=page is not None, items=len(page[0]) if page else 0)
+    if page is not None:
+        return page
+    return fetch_page(key, token)
+
+
+def fetch_page(key, token, data=None):
+    """
+    Fetch, parse and cache one page of a GraphQL category and return
+    (records, next pagination token). data is the already fetched page.
+    """
+    digest = None
+    stale = False
+    with tracing.span('page', key=key, token=token) as span:
+        if data is None:
+            response = fetch(gql_url([(key, token)], PAGE_LIMIT))
+            digest, stale = response.digest, response.stale
+            # A byte-identical payload gives the records stored last time
+            page = get_record_cache().reuse(page_key(key, token), digest,
+                                            None if stale else records_ttl(key))
+            if page is not None:
+                get_http_cache().count(parses_skipped=1)
+                if span:
+                    span.set(items=len(page[0]), reused=True)
+                return page
+            data = gql_split((key,), response)[key]
+        records, next_token = gql_items(key, data)
+        if span:
+            span.set(items=len(records))
+    if not stale:
+        get_record_cache().set(page_key(key, token), records, next_token, records_ttl(key), digest)
+    return records, next_token
+
+
+def fetchdata3(key, max_items=None, first=None):
+    """
+    Generator yielding the records of a GraphQL category one page at a time
+    up to max_items, every page is stored in the record cache on its own.
+    first is the already fetched data of the first page, see fetch_first_pages().
+    """
+    if max_items is None:
+        max_items = MAX_ITEMS
+    token = GQL_CATEGORIES[key][3]
+    count = 0
+
+    while count < max_items and token:
+        try:
+            items, token = fetch_page(key, token, first)
+        except Exception as e:
+            # the pages so far are better than none
+            if count == 0 or not network_error(e):
+                raise
+            log('stopping {} after {} items: {}'.format(key, count, e))
+            return
+        first = None
+        items = items[:max_items - count]
+        count += len(items)
+        if items:
+            yield items
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+    IMDB Trailers Kodi Addon
+    Copyright (C) 2018 gujal
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import random
+import threading
+import time
+
+import requests
+from six.moves import queue, urllib
+
+# Seconds to wait for a connection and between two reads of a response
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+# Attempts after the first one, waiting a random part of BACKOFF * 2^attempt
+RETRIES = 2
+BACKOFF = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# A duplicate request is sent once the first one takes longer than the
+# p95 latency of the host, known after HEDGE_SAMPLES requests
+LATENCY_SAMPLES = 50
+HEDGE_SAMPLES = 10
+HEDGE_MIN_DELAY = 0.25
+# Failed attempts in a row opening the circuit of a host, and for how long
+BREAKER_FAILURES = 3
+BREAKER_COOLDOWN = 60
+
+
+class NetworkError(Exception):
+    pass
+
+
+class DeadlineExceeded(NetworkError):
+    pass
+
+
+class CircuitOpen(NetworkError):
+    pass
+
+
+class Host(object):
+    """
+    Latencies of the last requests to a host and the state of its circuit.
+    The circuit opens after BREAKER_FAILURES failed attempts in a row and
+    lets a request through again once opened_until has passed.
+    """
+    __slots__ = ('name', 'latencies', 'failures', 'opened_until')
+
+    def __init__(self, name, latencies=None, failures=0, opened_until=0):
+        self.name = name
+        self.latencies = latencies or []
+        self.failures = failures
+        self.opened_until = opened_until
+
+    def hedge_delay(self):
+        if len(self.latencies) < HEDGE_SAMPLES:
+            return None
+        latencies = sorted(self.latencies)
+        return max(latencies[int(len(latencies) * 0.95)], HEDGE_MIN_DELAY)
+
+    def allow(self):
+        return self.opened_until <= time.time()
+
+    def success(self, latency):
+        self.latencies = self.latencies[1 - LATENCY_SAMPLES:] + [round(latency, 3)]
+        self.failures = 0
+        self.opened_until = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= BREAKER_FAILURES:
+            self.opened_until = time.time() + BREAKER_COOLDOWN
+        return not self.allow()
+
+
+class Client(object):
+    """
+    GETs through a requests session with timeouts bounded by a deadline,
+    retries of failed attempts with jittered backoff, a hedged duplicate
+    of requests slower than usual and a circuit breaker per host.
+
+    Every plugin action runs in a fresh interpreter, so the host state is
+    kept in store (see HttpCache.get_host()), which also counts the
+    retries, hedges and rejected requests. Failures are stored at once so
+    other actions see an open circuit, latencies when flush() is called.
+    """
+    def __init__(self, session, store):
+        self.session = session
+        self.store = store
+        self.hosts = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+
+    def host(self, url):
+        name = urllib.parse.urlparse(url).netloc
+        with self.lock:
+            if name not in self.hosts:
+                self.hosts[name] = Host(name, *self.store.get_host(name) or ())
+            return self.hosts[name]
+
+    def save(self, host):
+        with self.lock:
+            self.dirty.discard(host.name)
+            self.store.set_host(host.name, host.latencies, host.failures, host.opened_until)
+
+    def flush(self):
+        for name in list(self.dirty):
+            self.save(self.hosts[name])
+
+    def get(self, url, headers=None, deadline=None):
+        """
+        GET url and return the response. deadline is the time by which all
+        attempts must be done, None for no limit. Raises CircuitOpen while
+        the host is failing, DeadlineExceeded when the deadline passed, or
+        the error of the last attempt.
+        """
+        host = self.host(url)
+        if not host.allow():
+            self.store.count(circuit_rejected=1)
+            raise CircuitOpen('{} is failing, retrying after {:.0f}s'.format(host.name,
+                                                                              host.opened_until - time.time()))
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                response = self.send(url, headers, self.timeout(deadline), host.hedge_delay())
+                error = None
+            except requests.RequestException as e:
+                response, error = None, e
+            if error is None and response.status_code not in RETRY_STATUS:
+                failed = host.failures
+                host.success(time.time() - start)
+                if failed:
+                    self.save(host)
+                else:
+                    with self.lock:
+                        self.dirty.add(host.name)
+                response.attempts = attempt + 1
+                return response
+            opened = host.failure()
+            self.save(host)
+            delay = random.uniform(0, BACKOFF * 2 ** attempt)
+            remaining = deadline - time.time() if deadline else None
+            if attempt >= RETRIES or opened or (remaining is not None and remaining < delay):
+                if error is not None:
+                    raise error
+                response.attempts = attempt + 1
+                return response
+            self.store.count(retries=1)
+            time.sleep(delay)
+            attempt += 1
+
+    def timeout(self, deadline):
+        remaining = deadline - time.time() if deadline else None
+        if remaining is None:
+            return CONNECT_TIMEOUT, READ_TIMEOUT
+        if remaining <= 0:
+            raise DeadlineExceeded('time budget of the action spent')
+        return min(CONNECT_TIMEOUT, remaining), min(READ_TIMEOUT, remaining)
+
+    def send(self, url, headers, timeout, hedge_delay):
+        if hedge_delay is None:
+            return self.session.get(url, headers=headers, timeout=timeout)
+
+        results = queue.Queue()
+
+        def attempt():
+            try:
+                results.put((True, self.session.get(url, headers=headers, timeout=timeout)))
+            except Exception as e:
+                results.put((False, e))
+
+        self.spawn(attempt)
+        try:
+            ok, result = results.get(timeout=hedge_delay)
+        except queue.Empty:
+            self.store.count(hedged=1)
+            self.spawn(attempt)
+            ok, result = results.get()
+            if not ok:
+                # the other one may still succeed
+                ok, result = results.get()
+        if not ok:
+            raise result
+        return result
+
+    @staticmethod
+    def spawn(func):
+        t = threading.Thread(target=func)
+        t.daemon = True
+        t.start()
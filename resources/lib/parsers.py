@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+"""
+    IMDB Trailers Kodi Addon
+    Copyright (C) 2018 gujal
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import sys
+from resources.lib import tracing
+
+# HTMLParser() depreciated in Python 3.4 and removed in Python 3.9
+if sys.version_info >= (3,4,0):
+    import html
+    _html_parser = html
+else:
+    from six.moves import html_parser
+    _html_parser = html_parser.HTMLParser()
+
+# Blocks holding the listings, as (attribute, value) of the enclosing div
+MAIN_BLOCK = ('id', 'main')
+LIST_BLOCK = ('class', 'list detail')
+SEARCH_BLOCK = ('class', 'findList')
+
+
+def make_title(videoId, plot, icon, title, director, cast):
+    """
+    Build the normalized record of an "In Theaters" / "Coming Soon" entry,
+    shared by every backend so they only differ in how they find the fields.
+    """
+    h = _html_parser
+    plot = h.unescape(plot).strip()
+    # imdb = tdiv.find('a')['href'].split('/')[-2]
+    poster = icon.split('_')[0] + 'jpg'
+    try:
+        year = int(re.findall(r'\((\d{4})', title)[0])
+        title = re.sub(r'\s\(\d{4}\)', '', title)
+    except IndexError:
+        year = ''
+
+    return {'videoId': videoId,
+            # 'imdb': imdb,
+            'title': title,
+            'year': year,
+            'plot': plot,
+            'director': director,
+            'cast': cast,
+            'icon': icon,
+            'poster': poster}
+
+
+def make_result(href, title, icon):
+    return {'imdb': href.split('/')[2],
+            'title': title.strip(),
+            'icon': icon,
+            'poster': icon.split('_')[0] + 'jpg'}
+
+
+def video_id(href):
+    return href.split('?')[0].split('/')[-1]
+
+
+class Bs4Parser(object):
+    """
+    Reference backend using BeautifulSoup with the pure python html.parser.
+    """
+    name = 'bs4'
+
+    def __init__(self):
+        from bs4 import BeautifulSoup, SoupStrainer
+        self.soup = BeautifulSoup
+        self.strainer = SoupStrainer
+
+    def titles(self, page_data, block):
+        tlink = self.strainer('div', {block[0]: block[1]})
+        mdiv = self.soup(page_data, "html.parser", parse_only=tlink)
+        items = []
+        for video in mdiv.find_all('table'):
+            vdiv = video.find('a', {'itemprop': 'trailer'})
+            if vdiv:
+                tdiv = video.find(class_='image')
+                infos = video.find_all(class_='txt-block')
+                items.append(make_title(video_id(vdiv.get('href')),
+                                        video.find(class_='outline').text,
+                                        tdiv.find('img')['src'],
+                                        tdiv.find('img')['title'],
+                                        [name.text for name in infos[0].find_all('a')],
+                                        [name.text for name in infos[1].find_all('a')]))
+        mdiv.decompose()
+        return items
+
+    def search(self, page_data):
+        tlink = self.strainer('table', {SEARCH_BLOCK[0]: SEARCH_BLOCK[1]})
+        soup = self.soup(page_data, "html.parser", parse_only=tlink)
+        items = [make_result(item.find('a').get('href'), item.text, item.find('img')['src'])
+                 for item in soup.find_all('tr')]
+        soup.decompose()
+        return items
+
+
+class LxmlParser(object):
+    """
+    Backend using the libxml2 HTML parser, only available when lxml is installed.
+    """
+    name = 'lxml'
+
+    def __init__(self):
+        import lxml.html
+        self.html = lxml.html
+
+    @staticmethod
+    def has_class(name):
+        return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(name)
+
+    def titles(self, page_data, block):
+        if not page_data.strip():
+            return []
+        doc = self.html.fromstring(page_data)
+        items = []
+        for div in doc.xpath('//div[@{}="{}"]'.format(*block)):
+            for video in div.iter('table'):
+                vdiv = video.xpath('.//a[@itemprop="trailer"]')
+                if vdiv:
+                    img = video.xpath('(.//*[{}])[1]//img'.format(self.has_class('image')))[0]
+                    infos = video.xpath('.//*[{}]'.format(self.has_class('txt-block')))
+                    outline = video.xpath('(.//*[{}])[1]'.format(self.has_class('outline')))[0]
+                    items.append(make_title(video_id(vdiv[0].get('href')),
+                                            outline.text_content(),
+                                            img.get('src'),
+                                            img.get('title'),
+                                            [name.text_content() for name in infos[0].iter('a')],
+                                            [name.text_content() for name in infos[1].iter('a')]))
+        return items
+
+    def search(self, page_data):
+        if not page_data.strip():
+            return []
+        doc = self.html.fromstring(page_data)
+        items = []
+        for table in doc.xpath('//table[@{}="{}"]'.format(*SEARCH_BLOCK)):
+            for item in table.iter('tr'):
+                items.append(make_result(item.xpath('.//a')[0].get('href'),
+                                         item.text_content(),
+                                         item.xpath('.//img')[0].get('src')))
+        return items
+
+
+class StreamParser(object):
+    """
+    Dependency-free extractor. It does not build a tree, it jumps straight
+    to the findList / list detail / main blocks with targeted regexes and
+    only walks the few elements inside them the listings need.
+    """
+    name = 'stream'
+
+    TAGS = re.compile(r'<[^>]+>|<!--.*?-->', re.S)
+    NAME = re.compile(r'<\w*')
+    ATTR = re.compile(r'([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+)))?')
+
+    def attrs(self, tag):
+        h = _html_parser
+        return dict((m.group(1).lower(), h.unescape(m.group(2) or m.group(3) or m.group(4) or ''))
+                    for m in self.ATTR.finditer(tag, self.NAME.match(tag).end()))
+
+    def text(self, page_data, start, end):
+        return _html_parser.unescape(self.TAGS.sub('', page_data[start:end]))
+
+    @staticmethod
+    def opening(tag, attr, value, token=False):
+        if token:
+            value = r'(?:[^"\']*\s)?{}(?:\s[^"\']*)?'.format(re.escape(value))
+        else:
+            value = re.escape(value)
+        return re.compile(r'<({})\b[^>]*?\s{}\s*=\s*["\']{}["\'][^>]*>'.format(tag, attr, value), re.I)
+
+    @staticmethod
+    def closing(page_data, tag, pos, end):
+        """
+        Position of the tag closing the one opened just before pos.
+        """
+        depth = 1
+        for m in re.compile(r'<(/?){}\b[^>]*>'.format(tag), re.I).finditer(page_data, pos, end):
+            depth += -1 if m.group(1) else 1
+            if depth == 0:
+                return m.start()
+        return end
+
+    def elements(self, page_data, pattern, start, end):
+        """
+        Yield (opening tag, inner_start, inner_end) for the elements
+        matching the opening tag pattern between start and end.
+        """
+        pos = start
+        while True:
+            m = pattern.search(page_data, pos, end)
+            if m is None:
+                return
+            close = self.closing(page_data, m.group(1).lower(), m.end(), end)
+            yield m.group(0), m.end(), close
+            pos = m.end()
+
+    def find(self, page_data, pattern, start, end):
+        for element in self.elements(page_data, pattern, start, end):
+            return element
+
+    def blocks(self, page_data, pattern):
+        # Outermost matching blocks only, like a SoupStrainer
+        last = -1
+        for _, start, end in self.elements(page_data, pattern, 0, len(page_data)):
+            if start > last:
+                last = end
+                yield start, end
+
+    def titles(self, page_data, block):
+        table = re.compile(r'<(table)\b[^>]*>', re.I)
+        trailer = self.opening('a', 'itemprop', 'trailer')
+        image = self.opening(r'\w+', 'class', 'image', True)
+        img = re.compile(r'<img\b[^>]*>', re.I)
+        outline = self.opening(r'\w+', 'class', 'outline', True)
+        txt_block = self.opening(r'\w+', 'class', 'txt-block', True)
+        link = re.compile(r'<(a)\b[^>]*>', re.I)
+
+        items = []
+        for bstart, bend in self.blocks(page_data, self.opening('div', block[0], block[1])):
+            for _, start, end in self.elements(page_data, table, bstart, bend):
+                vdiv = trailer.search(page_data, start, end)
+                if vdiv:
+                    _, tstart, tend = self.find(page_data, image, start, end)
+                    tag = self.attrs(img.search(page_data, tstart, tend).group(0))
+                    _, ostart, oend = self.find(page_data, outline, start, end)
+                    people = [[self.text(page_data, astart, aend)
+                               for _, astart, aend in self.elements(page_data, link, istart, iend)]
+                              for _, istart, iend in list(self.elements(page_data, txt_block, start, end))[:2]]
+                    items.append(make_title(video_id(self.attrs(vdiv.group(0)).get('href')),
+                                            self.text(page_data, ostart, oend),
+                                            tag['src'],
+                                            tag['title'],
+                                            people[0],
+                                            people[1]))
+        return items
+
+    def search(self, page_data):
+        row = re.compile(r'<(tr)\b[^>]*>', re.I)
+        link = re.compile(r'<a\b[^>]*>', re.I)
+        img = re.compile(r'<img\b[^>]*>', re.I)
+
+        items = []
+        for bstart, bend in self.blocks(page_data, self.opening('table', SEARCH_BLOCK[0], SEARCH_BLOCK[1])):
+            for _, start, end in self.elements(page_data, row, bstart, bend):
+                items.append(make_result(self.attrs(link.search(page_data, start, end).group(0))['href'],
+                                         self.text(page_data, start, end),
+                                         self.attrs(img.search(page_data, start, end).group(0))['src']))
+        return items
+
+
+class Record(object):
+    """
+    Listing entry extracted from a GraphQL page. It also answers
+    record['field'] and record.get('field') like the dict records of the
+    HTML listings and of the record cache, so both can be listed the same way.
+    """
+    __slots__ = ('videoId', 'imdb', 'title', 'name', 'year', 'plot', 'duration', 'poster', 'fanart')
+
+    def __init__(self, videoId, imdb, title, name, year, plot, duration, poster, fanart):
+        self.videoId = videoId
+        self.imdb = imdb
+        self.title = title
+        self.name = name
+        self.year = year
+        self.plot = plot
+        self.duration = duration
+        self.poster = poster
+        self.fanart = fanart
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in self.__slots__)
+
+    def __eq__(self, other):
+        return isinstance(other, Record) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+
+# Field paths of the Record fields in one GraphQL item, as
+# (field, path or paths tried in order, default, field the value must differ from).
+# Items without a videoId have no trailer and are skipped.
+TITLE_SCHEMA = (('videoId', 'latestTrailer.id', None, None),
+                ('imdb', 'id', '', None),
+                ('title', 'titleText.text', '', None),
+                ('name', 'latestTrailer.name.value', '', None),
+                ('year', 'releaseDate.year', '', None),
+                ('plot', ('latestTrailer.description.value', 'plot.plotText.plainText'), '', 'name'),
+                ('duration', 'latestTrailer.runtime.value', '', None),
+                ('poster', ('primaryImage.url', 'latestTrailer.thumbnail.url'), '', None),
+                ('fanart', 'latestTrailer.thumbnail.url', '', None))
+VIDEO_SCHEMA = (('videoId', 'id', None, None),
+                ('imdb', 'primaryTitle.id', '', None),
+                ('title', 'primaryTitle.titleText.text', '', None),
+                ('name', 'name.value', '', None),
+                ('year', 'primaryTitle.releaseDate.year', '', None),
+                ('plot', ('description.value', 'primaryTitle.plot.plotText.plainText'), '', 'name'),
+                ('duration', 'runtime.value', '', None),
+                ('poster', ('primaryTitle.primaryImage.url', 'thumbnail.url'), '', None),
+                ('fanart', 'thumbnail.url', '', None))
+SCHEMAS = {'trending': TITLE_SCHEMA,
+           'anticipated': TITLE_SCHEMA,
+           'popular': TITLE_SCHEMA,
+           'recent': VIDEO_SCHEMA}
+_compiled = {}
+EMPTY = {}
+
+
+def compile_schema(schema):
+    """
+    Turn a schema into a tuple of its fields in Record order, each path
+    split once into the keys of the objects leading to the value and the
+    key of the value itself.
+    """
+    fields = []
+    for field, paths, default, differs in sorted(schema, key=lambda entry: Record.__slots__.index(entry[0])):
+        if not isinstance(paths, tuple):
+            paths = (paths,)
+        keys = []
+        for path in paths:
+            path = path.split('.')
+            keys.append((tuple(path[:-1]), path[-1]))
+        fields.append((field, tuple(keys), default, differs))
+    return tuple(fields)
+
+
+def lookup(item, path):
+    parents, key = path
+    for parent in parents:
+        item = item.get(parent) or EMPTY
+    return item.get(key)
+
+
+def extract(fields, item):
+    """
+    Record of one item following the compiled schema fields, or None for
+    items without a videoId. Missing objects on the paths fall back to an
+    empty dict instead of raising.
+    """
+    values = {}
+    for field, paths, default, differs in fields:
+        value = lookup(item, paths[0])
+        for path in paths[1:]:
+            if value and (differs is None or value != values[differs]):
+                break
+            value = lookup(item, path) or value
+        value = values[field] = value or default
+        if value is None and field == 'videoId':
+            return None
+    return Record(**values)
+
+
+def parse_graphql(key, items):
+    """
+    Records of the items of one GraphQL page of category key.
+    """
+    fields = _compiled.get(key)
+    if fields is None:
+        fields = _compiled[key] = compile_schema(SCHEMAS[key])
+    with tracing.span('parse', backend='schema') as span:
+        records = [record for record in (extract(fields, item) for item in items) if record is not None]
+        if span:
+            span.set(items=len(records))
+    return records
+
+
+# Preferred order for automatic selection
+BACKENDS = [LxmlParser, StreamParser, Bs4Parser]
+_parser = None
+
+
+def get_parser(name=None):
+    """
+    Return the named backend, or the fastest one that can be loaded here.
+    """
+    global _parser
+    if name:
+        return dict((backend.name, backend) for backend in BACKENDS)[name]()
+    if _parser is None:
+        for backend in BACKENDS:
+            try:
+                _parser = backend()
+                break
+            except ImportError:
+                continue
+    return _parser
+
+
+def parse_titles(page_data, block):
+    parser = get_parser()
+    with tracing.span('parse', backend=parser.name) as span:
+        items = parser.titles(page_data, block)
+        if span:
+            span.set(items=len(items))
+    return items
+
+
+def parse_search(page_data):
+    parser = get_parser()
+    with tracing.span('parse', backend=parser.name) as span:
+        items = parser.search(page_data)
+        if span:
+            span.set(items=len(items))
+    return items
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+    IMDB Trailers Kodi Addon
+    Copyright (C) 2018 gujal
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import random
+import time
+from kodi_six import xbmc
+from six.moves import reload_module
+from resources.lib import imdb_trailers, worker
+
+# Categories kept warm, in the order they appear in the main menu
+KEYS = ['showing', 'coming', 'trending', 'anticipated', 'popular', 'recent']
+# Seconds without user input before Kodi counts as idle
+IDLE_TIME = 60
+# Seconds between checks whether the cache databases need compacting
+COMPACT_INTERVAL = 24 * 3600
+
+
+class CacheWarmer(xbmc.Monitor):
+    """
+    Background service refreshing every category as soon as its cached
+    records expire, so interactive navigation almost always hits a warm cache.
+    Work is only done while Kodi is idle and nothing is playing.
+    It also runs the resident worker plugin invocations hand their work to.
+    """
+    def __init__(self):
+        super(CacheWarmer, self).__init__()
+        self.player = xbmc.Player()
+        self.compacted = 0
+        self.worker = worker.Worker()
+
+    def interval(self):
+        # Poll a few times per cache lifetime, with jitter so several
+        # devices (or restarts) do not hit IMDb at the same moment
+        base = min(max(imdb_trailers.CACHE_TIMEOUT / 16.0, 300), 1800)
+        return base * random.uniform(0.8, 1.2)
+
+    def is_idle(self):
+        return not self.player.isPlaying() and xbmc.getGlobalIdleTime() >= IDLE_TIME
+
+    def can_run(self):
+        return imdb_trailers._settings('warm_cache') == 'true' and self.is_idle()
+
+    def run(self):
+        imdb_trailers.log('cache warming service started')
+        if imdb_trailers.USE_WORKER:
+            self.worker.start()
+        try:
+            while not self.waitForAbort(self.interval()):
+                if self.can_run():
+                    self.warm()
+                if self.is_idle() and time.time() - self.compacted > COMPACT_INTERVAL:
+                    self.compact()
+        finally:
+            self.worker.stop()
+
+    def onSettingsChanged(self):
+        # The add-on reads its settings when imported, the worker has to
+        # pick up the new ones before it serves another listing
+        reload_module(imdb_trailers)
+        self.worker.stop()
+        self.worker.clear()
+        if imdb_trailers.USE_WORKER:
+            self.worker.start()
+
+    def compact(self):
+        self.compacted = time.time()
+        try:
+            imdb_trailers.compact_caches()
+        except Exception as e:
+            imdb_trailers.log('cache compaction failed: {}'.format(e))
+
+    def warm(self):
+        # Warming wants fresh data, the worker answering in the meantime
+        # gets it too, which is rare as the user is away
+        imdb_trailers.SERVE_STALE = False
+        try:
+            self.warm_keys([key for key in KEYS if imdb_trailers.records_expired(key)])
+        finally:
+            imdb_trailers.SERVE_STALE = True
+
+    def warm_keys(self, keys):
+        # The first pages of all expired GraphQL categories come in one request
+        first = {}
+        batch = [key for key in keys if key in imdb_trailers.GQL_CATEGORIES]
+        if len(batch) > 1:
+            try:
+                first = imdb_trailers.fetch_first_pages(batch)
+            except Exception as e:
+                imdb_trailers.log('cache warming batch failed: {}'.format(e))
+        for key in keys:
+            if self.abortRequested() or not self.can_run():
+                break
+            try:
+                imdb_trailers.refresh_records(key, first.get(key))
+                self.worker.clear()
+                imdb_trailers.log('cache warmed: {}'.format(key))
+            except Exception as e:
+                imdb_trailers.log('cache warming failed for {}: {}'.format(key, e))
+            # spread the requests out instead of bursting every category at once
+            if self.waitForAbort(random.uniform(2, 10)):
+                break
+        imdb_trailers.flush_client()
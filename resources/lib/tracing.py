@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+    IMDB Trailers Kodi Addon
+    Copyright (C) 2018 gujal
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+import threading
+import time
+
+# Number of trace files kept in the profile folder
+KEEP_TRACES = 20
+
+
+class NullSpan(object):
+    """
+    Span handed out while tracing is off. It is falsy so call sites can
+    skip computing fields: `if span: span.set(bytes=len(data))`.
+    """
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __bool__(self):
+        return False
+
+    __nonzero__ = __bool__
+
+
+NULL_SPAN = NullSpan()
+
+
+class NullTracer(object):
+    def span(self, name, **fields):
+        return NULL_SPAN
+
+
+class Span(object):
+    __slots__ = ('tracer', 'name', 'fields', 'start', 'duration', 'thread')
+
+    def __init__(self, tracer, name, fields):
+        self.tracer = tracer
+        self.name = name
+        self.fields = fields
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.time() - self.start
+        self.thread = threading.current_thread().name
+        if exc_type is not None:
+            self.fields['error'] = '{}: {}'.format(exc_type.__name__, exc)
+        self.tracer.spans.append(self)
+        return False
+
+    def __bool__(self):
+        return True
+
+    __nonzero__ = __bool__
+
+    def to_dict(self):
+        return dict(self.fields,
+                    name=self.name,
+                    start_ms=round((self.start - self.tracer.start) * 1000, 1),
+                    duration_ms=round(self.duration * 1000, 1),
+                    thread=self.thread)
+
+
+class Tracer(object):
+    """
+    Collects the spans of one plugin invocation.
+    """
+    def __init__(self, action):
+        self.action = action
+        self.start = time.time()
+        self.spans = []
+
+    def span(self, name, **fields):
+        return Span(self, name, fields)
+
+    def summary(self):
+        total = (time.time() - self.start) * 1000
+        parts = ['{} {:.0f}ms'.format(self.action, total)]
+        names = []
+        for span in self.spans:
+            if span.name not in names:
+                names.append(span.name)
+        for name in names:
+            spans = [span for span in self.spans if span.name == name]
+            part = '{} x{} {:.0f}ms'.format(name, len(spans), sum(span.duration for span in spans) * 1000)
+            hits = [span.fields['cache'] for span in spans if 'cache' in span.fields]
+            if hits:
+                part += ' {}/{} cached'.format(sum(1 for hit in hits if hit), len(hits))
+            size = sum(span.fields.get('bytes', 0) for span in spans)
+            if size:
+                part += ' {:.0f}KB'.format(size / 1024.0)
+            saved = sum(span.fields.get('saved', 0) for span in spans)
+            if saved:
+                part += ' {:.0f}KB saved'.format(saved / 1024.0)
+            items = sum(span.fields.get('items', 0) for span in spans)
+            if items:
+                part += ' {} items'.format(items)
+            parts.append(part)
+        return ', '.join(parts)
+
+    def write(self, folder):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        name = '{}{:03d}-{}.json'.format(time.strftime('%Y%m%d-%H%M%S', time.localtime(self.start)),
+                                         int(self.start * 1000) % 1000,
+                                         ''.join(c if c.isalnum() else '_' for c in self.action.lstrip('?'))[:60])
+        with open(os.path.join(folder, name), 'w') as f:
+            json.dump({'action': self.action,
+                       'started': self.start,
+                       'duration_ms': round((time.time() - self.start) * 1000, 1),
+                       'spans': [span.to_dict() for span in sorted(self.spans, key=lambda s: s.start)]}, f, indent=1)
+        for old in sorted(os.listdir(folder))[:-KEEP_TRACES]:
+            os.remove(os.path.join(folder, old))
+
+
+_tracer = NullTracer()
+
+
+def span(name, **fields):
+    """
+    Context manager timing one step, e.g. `with tracing.span('fetch', url=url) as span:`
+    """
+    return _tracer.span(name, **fields)
+
+
+def start(action):
+    global _tracer
+    _tracer = Tracer(action)
+
+
+def finish(folder):
+    """
+    Write the trace of the current invocation to folder and return its summary line.
+    """
+    global _tracer
+    tracer, _tracer = _tracer, NullTracer()
+    if isinstance(tracer, NullTracer):
+        return None
+    tracer.write(folder)
+    return tracer.summary()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+    IMDB Trailers Kodi Addon
+    Copyright (C) 2018 gujal
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 2 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import binascii
+import collections
+import json
+import os
+import socket
+import threading
+import time
+from kodi_six import xbmcgui
+from six.moves import socketserver
+
+# Home window property holding "<port> <token>" of the running worker
+PROPERTY = 'plugin.video.imdb.trailers.worker'
+# Seconds a listing stays in the worker's memory, and how many are kept
+MEMO_TTL = 300
+MEMO_SIZE = 64
+CONNECT_TIMEOUT = 0.5
+# Seconds past the deadline of the action the worker has to reply with
+# what it got by then
+REPLY_MARGIN = 5
+
+
+class Unavailable(Exception):
+    pass
+
+
+def listing(key):
+    from resources.lib import imdb_trailers
+    return list(imdb_trailers.listing(key))
+
+
+def page(key, token):
+    from resources.lib import imdb_trailers
+    return imdb_trailers.cached_page(key, token)
+
+
+def search(query):
+    from resources.lib import imdb_trailers
+    return imdb_trailers.search_titles(query)
+
+
+def video_url(video_id):
+    from resources.lib import imdb_trailers
+    return imdb_trailers.resolve_video_url(video_id)
+
+
+def title_url(imdb):
+    from resources.lib import imdb_trailers
+    return imdb_trailers.resolve_title_url(imdb)
+
+
+# Operations the plugin hands to the worker: name -> (function, memoized).
+# Listings are memoized, stream URLs come from the stream cache which
+# knows when they expire.
+OPS = {'listing': (listing, True),
+       'page': (page, True),
+       'search': (search, True),
+       'video_url': (video_url, False),
+       'title_url': (title_url, False),
+       'clear': (None, False)}
+
+
+def network_error(e):
+    from resources.lib import imdb_trailers
+    return imdb_trailers.network_error(e)
+
+
+def call(op, args, deadline=None):
+    """
+    Return the result of op(*args) run by the worker, its requests ending
+    by deadline like the ones of the caller. Raises NetworkError when op
+    failed on the network there, or Unavailable when the worker is not
+    running or fails otherwise, the caller then runs op itself.
+    """
+    value = xbmcgui.Window(10000).getProperty(PROPERTY)
+    if not value:
+        raise Unavailable('not running')
+    port, token = value.split()
+    try:
+        sock = socket.create_connection(('127.0.0.1', int(port)), CONNECT_TIMEOUT)
+    except (socket.error, ValueError) as e:
+        raise Unavailable('not reachable: {}'.format(e))
+    try:
+        sock.settimeout(max(deadline - time.time(), 0) + REPLY_MARGIN if deadline else None)
+        request = {'token': token, 'op': op, 'args': args, 'deadline': deadline}
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        reply = json.loads(sock.makefile('rb').readline().decode('utf-8'))
+    except (socket.error, ValueError) as e:
+        raise Unavailable('no answer: {}'.format(e))
+    finally:
+        sock.close()
+    if 'error' in reply:
+        if reply.get('network'):
+            from resources.lib import network
+            raise network.NetworkError(reply['error'])
+        raise Unavailable(reply['error'])
+    return reply['result']
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            reply = {'result': self.server.worker.run(request)}
+        except Exception as e:
+            reply = {'error': '{}: {}'.format(type(e).__name__, e), 'network': network_error(e)}
+        self.wfile.write(json.dumps(reply, default=lambda record: record.to_dict()).encode('utf-8') + b'\n')
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Worker(object):
+    """
+    Runs the listings and stream lookups of plugin invocations inside the
+    long-lived service process. Its HTTP session, parsed HLS playlists and
+    the listings it served stay in memory, so a listing seen before is
+    answered without touching the network or the databases. Plugin
+    invocations find it through a home window property, see call().
+    """
+    def __init__(self):
+        self.server = None
+        self.token = None
+        self.memo = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.token = binascii.hexlify(os.urandom(16)).decode('ascii')
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.worker = self
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        xbmcgui.Window(10000).setProperty(PROPERTY, '{} {}'.format(self.server.server_address[1], self.token))
+
+    def stop(self):
+        xbmcgui.Window(10000).clearProperty(PROPERTY)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def run(self, request):
+        if request.get('token') != self.token:
+            raise ValueError('bad token')
+        op, args, deadline = request['op'], request['args'], request.get('deadline')
+        func, memoized = OPS[op]
+        if func is None:
+            self.clear()
+            return None
+        from resources.lib import imdb_trailers
+        imdb_trailers.set_deadline(deadline)
+        if not memoized:
+            return func(*args)
+        key = json.dumps([op, args])
+        with self.lock:
+            hit = self.memo.get(key)
+            if hit is not None and hit[0] > time.time():
+                self.memo[key] = self.memo.pop(key)
+                return hit[1]
+        result = func(*args)
+        if deadline and time.time() > deadline:
+            # what arrived by the deadline, maybe not all of the listing
+            return result
+        with self.lock:
+            self.memo[key] = (time.time() + MEMO_TTL, result)
+            while len(self.memo) > MEMO_SIZE:
+                self.memo.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.memo.clear()